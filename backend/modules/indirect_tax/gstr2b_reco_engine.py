@@ -3,66 +3,82 @@ import pandas as pd
 from io import BytesIO
 import numpy as np
 import re
+from concurrent.futures import ThreadPoolExecutor
 from xlsxwriter.utility import xl_col_to_name
 
+from modules.indirect_tax.gstr_reco_common import (
+    is_yes_flag, dedup_columns, coerce_numeric_cols, sheet_formats, unique_sheet_names, write_data_rows
+)
+
 logger = logging.getLogger(__name__)
 
 # ==========================================
 #  SECTION 1: SHARED UTILITIES (ADVANCED)
 # ==========================================
 
+SUBTOTAL_COLS = [
+    'Taxable Value', 'Invoice Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount', 'Cess Amount',
+    'IGST', 'CGST', 'SGST', 'Cess', 'Total', 'Taxable Amt.', 'Debit', 'Credit',
+    'As per portal', 'As per Books', 'Difference'
+]
+
 def add_formatting_and_subtotals(writer, df, sheet_name):
     if df.empty: return 
     
     # Safety: Drop duplicate columns
-    df = df.loc[:, ~df.columns.duplicated()]
-    
-    # Write dataframe
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
+    df = dedup_columns(df)
     
     workbook = writer.book
-    worksheet = writer.sheets[sheet_name]
+    worksheet = workbook.add_worksheet(sheet_name)
     (num_rows, num_cols) = df.shape
-
-    # Formats
-    header_format = workbook.add_format({'bold': True, 'bg_color': '#D7E4BC', 'border': 1})
-    bold_format = workbook.add_format({'bold': True})
-    number_format = workbook.add_format({'bold': True, 'num_format': '#,##0.00'})
-    red_format = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006'}) 
-    green_format = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'}) 
-    
-    for col_num, value in enumerate(df.columns.values):
-        worksheet.write(0, col_num, value, header_format)
-        worksheet.set_column(col_num, col_num, 15)
+    total_row = num_rows + 1
+    # Columns are unique at this point, so one position map and one list of
+    # column letters serve every lookup below.
+    col_pos = {c: i for i, c in enumerate(df.columns)}
+    letters = [xl_col_to_name(i) for i in range(num_cols)]
+
+    fmt = sheet_formats(workbook)
+    header_format, bold_format, number_format = fmt['header'], fmt['bold'], fmt['number']
+    red_format, green_format, date_format = fmt['red'], fmt['green'], fmt['date']
+
+    # generate_reco_report opens the workbook in constant_memory mode, where
+    # xlsxwriter flushes a row to disk as soon as a later row is written --
+    # so cells go out strictly top to bottom (header, data, totals). Column
+    # widths, the autofilter and conditional formats are sheet-level
+    # settings and are declared up front. df.to_excel can't be used here: it
+    # writes column by column, which would silently drop every earlier row.
+    if num_cols: worksheet.set_column(0, num_cols - 1, 15)
+    for col_num, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            worksheet.set_column(col_num, col_num, 15, date_format)
 
     if num_rows > 0:
         worksheet.autofilter(0, 0, num_rows, num_cols - 1)
 
-    total_row = num_rows + 1
-    worksheet.write(total_row, 0, 'Filter Total', bold_format)
-    
-    # Subtotals
-    target_cols = [
-        'Taxable Value', 'Invoice Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount', 'Cess Amount',
-        'IGST', 'CGST', 'SGST', 'Cess', 'Total', 'Taxable Amt.', 'Debit', 'Credit',
-        'As per portal', 'As per Books', 'Difference'
-    ]
-    
-    for col_name in target_cols:
-        if col_name in df.columns:
-            col_idx = df.columns.get_loc(col_name)
-            col_letter = xl_col_to_name(col_idx)
-            formula = f'=SUBTOTAL(9,{col_letter}2:{col_letter}{total_row})'
-            worksheet.write_formula(total_row, col_idx, formula, number_format)
-            
     # Conditional Formatting for Remarks
-    if 'Remarks' in df.columns:
-        rem_idx = df.columns.get_loc('Remarks')
-        rem_letter = xl_col_to_name(rem_idx)
+    rem_idx = col_pos.get('Remarks')
+    if rem_idx is not None:
+        rem_letter = letters[rem_idx]
         range_str = f"{rem_letter}2:{rem_letter}{total_row}"
         worksheet.conditional_format(range_str, {'type': 'text', 'criteria': 'containing', 'value': 'Not', 'format': red_format})
         worksheet.conditional_format(range_str, {'type': 'text', 'criteria': 'containing', 'value': 'Match', 'format': green_format})
 
+    worksheet.write_row(0, 0, list(df.columns.values), header_format)
+    write_data_rows(worksheet, df, fmt)
+
+    worksheet.write(total_row, 0, 'Filter Total', bold_format)
+    
+    # Subtotals -- each run of adjacent subtotal columns goes out as one
+    # write_row; gaps between runs are left untouched (no formatted blanks).
+    sub_idxs = sorted(col_pos[c] for c in SUBTOTAL_COLS if c in col_pos)
+    run_start = 0
+    for k in range(1, len(sub_idxs) + 1):
+        if k < len(sub_idxs) and sub_idxs[k] == sub_idxs[k - 1] + 1: continue
+        run = sub_idxs[run_start:k]
+        formulas = [f'=SUBTOTAL(9,{letters[i]}2:{letters[i]}{total_row})' for i in run]
+        worksheet.write_row(total_row, run[0], formulas, number_format)
+        run_start = k
+
 # ==========================================
 #  SECTION 2: PORTAL CLEANING LOGIC (FIXED)
 # ==========================================
@@ -87,25 +103,31 @@ def filter_portal_sheets(xls):
         sheet_clean = sheet.strip()
         if sheet_clean in sheets_to_delete_always: continue
         try:
-            df = pd.read_excel(xls, sheet_name=sheet, header=None)
+            # Only the rows up to the first data row are parsed to decide
+            # whether an optional sheet is empty, so a sheet that gets
+            # dropped never has its full XML read.
             if sheet_clean in conditional_delete_map:
                 target_idx = conditional_delete_map[sheet_clean] - 1
-                if len(df) <= target_idx or df.iloc[target_idx].isna().all(): continue
-            kept_dataframes[sheet] = df
+                probe = pd.read_excel(xls, sheet_name=sheet, header=None, nrows=target_idx + 1)
+                if len(probe) <= target_idx or probe.iloc[target_idx].isna().all(): continue
+            kept_dataframes[sheet] = pd.read_excel(xls, sheet_name=sheet, header=None)
         except Exception as e:
             logger.warning(f"Skipped portal sheet '{sheet}': {e}")
             continue
     return kept_dataframes
 
+HEADER_SEARCH_RE = re.compile(r'gstin of supplier|invoice number|note number|bill of entry number')
+WHITESPACE_RE = re.compile(r'\s+')
+
 def clean_portal_df(df_raw, sheet_name):
     # 1. Header Logic
-    header_idx = -1
-    search_terms = ['gstin of supplier', 'invoice number', 'note number', 'bill of entry number']
-    for i in range(min(10, len(df_raw))):
-        row_str = " ".join(df_raw.iloc[i].astype(str).fillna('').values).lower()
-        if any(term in row_str for term in search_terms):
-            header_idx = i; break
-    if header_idx == -1: return pd.DataFrame()
+    # The first 10 rows are joined and searched as one block rather than
+    # building a Series per row.
+    head = df_raw.head(10).astype(str)
+    row_strs = head.agg(' '.join, axis=1).str.lower() if not head.empty else pd.Series(dtype=str)
+    hits = row_strs.str.contains(HEADER_SEARCH_RE).to_numpy()
+    if not hits.any(): return pd.DataFrame()
+    header_idx = int(hits.argmax())
 
     df_data = df_raw.iloc[header_idx+1:].reset_index(drop=True)
     row1 = df_raw.iloc[header_idx].astype(str).replace('nan', '').str.strip().tolist()
@@ -136,7 +158,7 @@ def clean_portal_df(df_raw, sheet_name):
     # and a strict compare silently failed to rename the column at all when
     # the spacing didn't match the hardcoded key exactly.
     def _norm(s):
-        return re.sub(r'\s+', '', str(s).lower())
+        return WHITESPACE_RE.sub('', str(s).lower())
 
     rename_map_norm = {_norm(k): v for k, v in rename_map.items()}
     final_cols = []
@@ -145,21 +167,34 @@ def clean_portal_df(df_raw, sheet_name):
     
     # === CORRECTION: Rename FIRST, then drop duplicates ===
     df_data.columns = final_cols
-    df_data = df_data.loc[:, ~df_data.columns.duplicated()]
+    df_data = dedup_columns(df_data)
     # ====================================================
 
     numeric_cols = ['Taxable Value', 'Invoice Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount', 'Cess Amount', 'Rate']
-    for col in numeric_cols:
-        if col in df_data.columns: df_data[col] = pd.to_numeric(df_data[col], errors='coerce').fillna(0)
+    present = coerce_numeric_cols(df_data, numeric_cols)
 
     unwanted = ['period', 'filing date', 'applicable %', 'source', 'irn']
     cols_to_drop = [c for c in df_data.columns if any(kw in str(c).lower() for kw in unwanted)]
     if cols_to_drop: df_data.drop(columns=cols_to_drop, inplace=True, errors='ignore')
 
-    df_data = df_data.replace(r'^\s*$', np.nan, regex=True).dropna(axis=1, how='all')
-    for col in numeric_cols:
-        if col in df_data.columns and df_data[col].abs().max() == 0: df_data.drop(columns=[col], inplace=True)
-        
+    # Whitespace-only text cells become NaN so all-blank columns drop out. A
+    # strip() compare on the text-bearing columns does this without running a
+    # regex over every cell; infer_objects keeps the dtype inference that
+    # replace() used to apply as a side effect.
+    for col in df_data.select_dtypes(include='object').columns:
+        col_vals = df_data[col]
+        if pd.api.types.infer_dtype(col_vals, skipna=True) not in ('string', 'mixed', 'mixed-integer'): continue
+        is_blank = col_vals.str.strip().eq('').to_numpy()
+        if is_blank.any(): df_data[col] = col_vals.mask(is_blank)
+    df_data = df_data.infer_objects().dropna(axis=1, how='all')
+    # All-zero amount columns are found in one pass over the numeric block
+    # (already coerced and zero-filled above) instead of abs()+max() per column.
+    present = [c for c in present if c in df_data.columns]
+    if present and not df_data.empty:
+        nonzero = (df_data[present].to_numpy() != 0).any(axis=0)
+        zero_cols = [c for c, keep in zip(present, nonzero) if not keep]
+        if zero_cols: df_data.drop(columns=zero_cols, inplace=True)
+
     return df_data
 
 # Sheets that carry ITC-eligibility information rather than a distinct set of
@@ -169,10 +204,15 @@ def clean_portal_df(df_raw, sheet_name):
 # reconciling them too would double-count those invoices.
 ITC_REFERENCE_SHEETS = {"ITC Available", "ITC not available", "ITC Reversal", "ITC Rejected"}
 
+# Threads used to reconcile sheets side by side in compute_reco_data
+RECO_WORKERS = 4
+
 # ==========================================
 #  SECTION 3: ODOO CLEANING LOGIC (PRESERVED)
 # ==========================================
 
+RATE_RE = re.compile(r'(\d+\.?\d*)%')
+
 def clean_odoo_data(df, is_rcm=False):
     required_cols = ['Account', 'Label', 'Date']
     for col in required_cols:
@@ -185,10 +225,12 @@ def clean_odoo_data(df, is_rcm=False):
     df['Credit'] = pd.to_numeric(df['Credit'], errors='coerce').fillna(0)
 
     # Tax Calculation
-    account_series = df['Account'].astype(str)
-    is_igst = account_series.str.contains('igst', case=False, na=False)
-    is_cgst = account_series.str.contains('cgst', case=False, na=False)
-    is_sgst = account_series.str.contains('sgst', case=False, na=False)
+    # Lower-cased once up front so the three checks below are plain substring
+    # scans, rather than three case-insensitive regex passes over the column.
+    account_series = df['Account'].astype(str).str.lower()
+    is_igst = account_series.str.contains('igst', regex=False).to_numpy()
+    is_cgst = account_series.str.contains('cgst', regex=False).to_numpy()
+    is_sgst = account_series.str.contains('sgst', regex=False).to_numpy()
     
     if is_rcm:
         condition = df['Debit'] != 0
@@ -205,7 +247,9 @@ def clean_odoo_data(df, is_rcm=False):
     df.loc[mask_missing_sgst, 'SGST'] = df.loc[mask_missing_sgst, 'CGST']
 
     if 'Label' in df.columns:
-        df['Rate'] = df['Label'].astype(str).str.extract(r'(\d+\.?\d*)%').astype(float)
+        # expand=False hands back the capture group as a Series directly
+        # rather than wrapping it in a one-column DataFrame first.
+        df['Rate'] = df['Label'].astype(str).str.extract(RATE_RE, expand=False).astype(float)
         df['Rate_Str'] = df['Rate'].map('{:.2f}%'.format, na_action='ignore')
     else:
         df['Rate'] = 0.0; df['Rate_Str'] = '0.00%'
@@ -238,6 +282,17 @@ def clean_odoo_data(df, is_rcm=False):
         if col not in df.columns: df[col] = '' 
     return df[final_columns]
 
+def _concat_ledgers(dfs):
+    """Stacks the CGST/IGST ledger exports of one kind. Both are aligned to
+    the same column set up front (in first-seen order, same as concat's own
+    union) so concat takes its block-aligned fast path, and copy=False
+    reuses the input buffers instead of materializing them once more."""
+    if len(dfs) == 1:
+        return dfs[0].reset_index(drop=True)
+    all_cols = list(dict.fromkeys(c for d in dfs for c in d.columns))
+    aligned = [d if list(d.columns) == all_cols else d.reindex(columns=all_cols) for d in dfs]
+    return pd.concat(aligned, ignore_index=True, copy=False)
+
 def process_odoo_logic_4files(file_dict):
     """
     Processes the 4 distinct Odoo files:
@@ -265,7 +320,7 @@ def process_odoo_logic_4files(file_dict):
     regular_dfs = [d for d in [reg_cgst, reg_igst] if d is not None]
 
     if regular_dfs:
-        reg_df = pd.concat(regular_dfs, ignore_index=True)
+        reg_df = _concat_ledgers(regular_dfs)
         if 'Credit' in reg_df.columns:
             v_cn_mask = reg_df['Credit'] != 0
             processed_results['B2B as per Books'] = clean_odoo_data(reg_df[~v_cn_mask].copy(), is_rcm=False)
@@ -279,7 +334,7 @@ def process_odoo_logic_4files(file_dict):
     rcm_dfs = [d for d in [rcm_cgst, rcm_igst] if d is not None]
 
     if rcm_dfs:
-        rcm_df = pd.concat(rcm_dfs, ignore_index=True)
+        rcm_df = _concat_ledgers(rcm_dfs)
         if 'Debit' in rcm_df.columns:
             # For RCM, Credit Notes usually have Debit values
             rcm_cn_mask = rcm_df['Debit'] != 0
@@ -300,9 +355,26 @@ def process_odoo_logic_4files(file_dict):
 #  SECTION 4: RECO ENGINE (ADVANCED FUZZY & DATE)
 # ==========================================
 
-def clean_inv_str(s):
-    if pd.isna(s): return ""
-    return re.sub(r'[^a-zA-Z0-9]', '', str(s).lower())
+INV_CLEAN_RE = re.compile(r'[^a-z0-9]+')
+
+def clean_inv_series(s):
+    """Lowercases a column of invoice numbers and strips everything but
+    a-z/0-9, in one pass over the column. Values are stringified as-is, so a
+    missing number comes out as 'nan' -- callers that need blanks mask it.
+
+    The string work runs on the distinct values only and is mapped back by
+    code -- the same invoice shows up once per tax rate on the portal and
+    once per ledger line in the books, so there are far fewer of them."""
+    def _clean(values):
+        return values.astype(str).str.lower().str.replace(INV_CLEAN_RE, '', regex=True).to_numpy(dtype=object)
+
+    codes, uniques = pd.factorize(s)
+    missing = codes == -1
+    out = np.empty(len(s), dtype=object)
+    out[~missing] = _clean(pd.Series(uniques))[codes[~missing]]
+    # NaN and None stringify differently, so missing values keep their own str()
+    if missing.any(): out[missing] = _clean(s[missing])
+    return pd.Series(out, index=s.index, dtype=object)
 
 def get_itc_deadline(invoice_date):
     """Section 16(4): ITC on an invoice must be claimed by 30th November
@@ -315,62 +387,99 @@ def get_itc_deadline(invoice_date):
     fy_end_year = year + 1 if month >= 4 else year
     return pd.Timestamp(year=fy_end_year, month=11, day=30)
 
+def get_itc_deadlines(invoice_dates):
+    """Column version of get_itc_deadline for a datetime Series; unusable
+    dates come back as NaT."""
+    fy_end_year = invoice_dates.dt.year + (invoice_dates.dt.month >= 4)
+    return pd.to_datetime(pd.DataFrame({'year': fy_end_year, 'month': 11, 'day': 30}), errors='coerce')
+
 def generate_lookup_map(data_source):
-    exact_map = {}
-    amount_map = {}
-
-    for key, val in data_source.items():
-        if isinstance(val, pd.DataFrame): df = val
-        else: df = val['df']
-
-        # Support both Taxable Value and Taxable Amt.
-        col_inv = 'Invoice Number'
-        col_tax = 'Taxable Value' if 'Taxable Value' in df.columns else 'Taxable Amt.'
-
-        if col_inv in df.columns and col_tax in df.columns:
-            for _, row in df.iterrows():
-                inv_raw = str(row[col_inv]).strip()
-                inv_clean = clean_inv_str(inv_raw)
-                if not inv_clean:
-                    continue
-
-                try:
-                    raw_tax = float(row[col_tax])
-                    tax_val = raw_tax if pd.notnull(raw_tax) else 0.0
-                except (TypeError, ValueError):
-                    tax_val = 0.0
-
-                # Exact-match key is normalized the same way as the fuzzy key
-                # (lowercased, punctuation/whitespace stripped) so "INV-001",
-                # "inv 001" and "INV001" are all treated as the same invoice
-                # instead of only matching on identical formatting.
-                if inv_clean not in exact_map:
-                    exact_map[inv_clean] = tax_val
-
-                # Bucketed to the nearest rupee rather than the exact paisa
-                # value, so a small rounding difference between the portal
-                # and the books doesn't stop the fuzzy invoice-number check
-                # below from ever getting a chance to run.
-                amt_key = round(tax_val)
-                amount_map.setdefault(amt_key, []).append({
-                    'clean_inv': inv_clean,
-                    'tax_val': tax_val
-                })
+    return generate_lookup_maps(data_source)[0]
+
+def generate_lookup_maps(*data_sources):
+    """(exact_map, amount_map) for each data source, in order. All sheets of
+    all sources are stacked into one frame so the key cleaning runs once as a
+    column operation -- the portal and the books list mostly the same
+    invoice numbers, so cleaning both sides together does that work once."""
+    frames = []
+    for side, data_source in enumerate(data_sources):
+        for key, val in data_source.items():
+            if isinstance(val, pd.DataFrame): df = val
+            else: df = val['df']
+
+            # Support both Taxable Value and Taxable Amt.
+            col_inv = 'Invoice Number'
+            col_tax = 'Taxable Value' if 'Taxable Value' in df.columns else 'Taxable Amt.'
+
+            if col_inv in df.columns and col_tax in df.columns:
+                frames.append(pd.DataFrame({'side': side, 'inv': df[col_inv].to_numpy(), 'tax': df[col_tax].to_numpy()}))
+
+    if not frames:
+        return [({}, {}) for _ in data_sources]
+
+    combined = pd.concat(frames, ignore_index=True, copy=False)
+    # Exact-match key is normalized the same way as the fuzzy key
+    # (lowercased, punctuation/whitespace stripped) so "INV-001",
+    # "inv 001" and "INV001" are all treated as the same invoice
+    # instead of only matching on identical formatting.
+    combined['clean_inv'] = clean_inv_series(combined['inv'])
+    combined['tax_val'] = pd.to_numeric(combined['tax'], errors='coerce').fillna(0.0).astype(float)
+    combined = combined[combined['clean_inv'] != '']
+
+    sides = combined['side'].to_numpy()
+    return [_maps_from_lookup_rows(combined[sides == side]) for side in range(len(data_sources))]
+
+def _maps_from_lookup_rows(rows):
+    # First occurrence wins, same as before.
+    exact_map = rows.groupby('clean_inv', sort=False)['tax_val'].first().to_dict()
+
+    # Bucketed to the nearest rupee rather than the exact paisa
+    # value, so a small rounding difference between the portal
+    # and the books doesn't stop the fuzzy invoice-number check
+    # in apply_reco_logic from ever getting a chance to run.
+    # Buckets are read off the group positions directly, so no sub-frame is
+    # built per bucket.
+    amt_keys = rows['tax_val'].round().astype(np.int64)
+    clean_vals = rows['clean_inv'].to_numpy()
+    tax_vals = rows['tax_val'].to_numpy()
+    amount_map = {
+        int(amt_key): [{'clean_inv': clean_vals[i], 'tax_val': float(tax_vals[i])} for i in pos]
+        for amt_key, pos in amt_keys.groupby(amt_keys.to_numpy(), sort=False).indices.items()
+    }
 
     return exact_map, amount_map
 
+def _fuzzy_lookup(inv_clean, my_tax, amount_map):
+    """Taxable value of the first candidate whose cleaned invoice number
+    contains (or is contained in) inv_clean, or None. Same substring logic
+    as always, but checked across neighboring rupee buckets (not just the
+    exact paisa bucket) so small rounding differences don't block it."""
+    rounded = round(my_tax)
+    for amt_key in (rounded, rounded - 1, rounded + 1):
+        for cand in amount_map.get(amt_key, ()):
+            cand_clean = cand['clean_inv']
+            if (inv_clean in cand_clean) or (cand_clean in inv_clean):
+                return cand['tax_val']
+    return None
+
 def apply_reco_logic(df, lookup_maps, target_col_name, is_portal_sheet, reco_month_dt=None):
     exact_map, amount_map = lookup_maps
 
-    df[target_col_name] = 0.0; df['Difference'] = 0.0; df['Remarks'] = ''
-    if is_portal_sheet:
-        df['ITC Time-Barred'] = ''
     col_inv = 'Invoice Number'
     col_tax = 'Taxable Value' if 'Taxable Value' in df.columns else 'Taxable Amt.'
     col_date = 'Invoice date'
 
-    if col_inv not in df.columns: return df
-
+    # The result columns are built as plain arrays and attached in a single
+    # assign() at the end, instead of being initialised and then overwritten
+    # column by column on the (often sliced) input frame.
+    n = len(df)
+    if col_inv not in df.columns:
+        blanks = {target_col_name: 0.0, 'Difference': 0.0, 'Remarks': ''}
+        if is_portal_sheet: blanks['ITC Time-Barred'] = ''
+        return df.assign(**blanks)
+
+    new_cols = {}
+    inv_dates = None
     if col_date in df.columns:
         # Try day-first first (standard Indian format); anything still
         # unparsed gets a second attempt the other way round instead of
@@ -380,114 +489,123 @@ def apply_reco_logic(df, lookup_maps, target_col_name, is_portal_sheet, reco_mon
         still_unparsed = parsed.isna() & raw_dates.notna()
         if still_unparsed.any():
             parsed.loc[still_unparsed] = pd.to_datetime(raw_dates[still_unparsed], dayfirst=False, errors='coerce')
-        df[col_date] = parsed
+        new_cols[col_date] = inv_dates = parsed
 
     today = pd.Timestamp.now().normalize()
 
-    def row_logic(row):
-        inv_raw = str(row.get(col_inv, '')).strip()
-        inv_clean = clean_inv_str(inv_raw)
-
-        my_tax = float(row.get(col_tax, 0)) if pd.notnull(row.get(col_tax, 0)) else 0.0
-
-        remark = ""
-        other_val = 0.0
-        diff = 0.0
-        match_found = False
-
-        # 1. Exact match (case/whitespace/punctuation-insensitive)
-        if inv_clean and inv_clean in exact_map:
-            other_val = exact_map[inv_clean]
-            match_found = True
-            remark = "Match" if abs(my_tax - other_val) < 2 else "Mismatch"
-
-        # 2. Fuzzy match: same invoice-number substring logic as before, but
-        # checked across neighboring rupee buckets (not just the exact paisa
-        # bucket) so small rounding differences don't block it.
-        if not match_found and inv_clean:
-            rounded = round(my_tax)
-            for amt_key in (rounded, rounded - 1, rounded + 1):
-                candidates = amount_map.get(amt_key)
-                if not candidates:
-                    continue
-                for cand in candidates:
-                    cand_clean = cand['clean_inv']
-                    if cand_clean and ((inv_clean in cand_clean) or (cand_clean in inv_clean)):
-                        other_val = cand['tax_val']
-                        match_found = True
-                        remark = "Match (Fuzzy)"
-                        break
-                if match_found:
-                    break
-
-        if match_found:
-            diff = my_tax - other_val
-            if abs(diff) > 2: remark = "Mismatch"
-        else:
-            remark = "Not in Books" if is_portal_sheet else "Not on Portal"
-            diff = my_tax
+    # Matching runs column-wise: the exact pass is a single dict map over the
+    # cleaned keys, and only the rows it leaves unmatched go through the
+    # per-invoice fuzzy check.
+    inv_clean = clean_inv_series(df[col_inv])
+    if col_tax in df.columns:
+        my_tax = pd.to_numeric(df[col_tax], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    else:
+        my_tax = np.zeros(n)
+
+    # 1. Exact match (case/whitespace/punctuation-insensitive)
+    other_val = inv_clean.map(exact_map).to_numpy(dtype=float)
+    matched = ~np.isnan(other_val)
+
+    # 2. Fuzzy match, only for rows the exact pass left unmatched. The result
+    # depends only on the key and the rupee bucket, and portal sheets list an
+    # invoice once per tax rate, so each (key, bucket) pair is looked up once.
+    fuzzy = np.zeros(n, dtype=bool)
+    fuzzy_cache = {}
+    rounded = np.rint(my_tax)
+    for i in np.flatnonzero(~matched):
+        key = inv_clean.iat[i]
+        if not key: continue
+        cache_key = (key, rounded[i])
+        if cache_key not in fuzzy_cache:
+            fuzzy_cache[cache_key] = _fuzzy_lookup(key, my_tax[i], amount_map)
+        fuzzy_val = fuzzy_cache[cache_key]
+        if fuzzy_val is not None:
+            other_val[i] = fuzzy_val
+            fuzzy[i] = True
+    matched |= fuzzy
+
+    diff = np.where(matched, my_tax - np.nan_to_num(other_val), my_tax)
+    remarks = np.select(
+        [matched & (np.abs(diff) > 2), fuzzy, matched & (np.abs(diff) < 2), matched],
+        ['Mismatch', 'Match (Fuzzy)', 'Match', 'Mismatch'],
+        default='Not in Books' if is_portal_sheet else 'Not on Portal',
+    ).astype(object)
+    new_cols[target_col_name] = np.where(matched, other_val, 0.0)
+    new_cols['Difference'] = diff
+    new_cols['Remarks'] = remarks
 
-        itc_barred = ''
-        inv_dt = row.get(col_date) if col_date in row else None
-        has_date = isinstance(inv_dt, pd.Timestamp) and pd.notnull(inv_dt)
+    if is_portal_sheet:
+        new_cols['ITC Time-Barred'] = ''
 
-        # 3. Previous-period check (portal side only, requires a reco month).
+    # The date checks run on the parsed datetime column as a whole rather
+    # than per row; NaT compares False everywhere, so undated rows fall
+    # through untouched exactly as before.
+    if is_portal_sheet and inv_dates is not None and n:
+        # 3. Previous-period check (requires a reco month).
         # A matched invoice dated before the reco month is relabeled
         # "Previous Month Input" -- this exact remark is what feeds the
         # GSTR-3B engine's "previous month reflecting in this month claimed"
         # bucket (see gstr3b_engine.py), so it's not just cosmetic.
-        if is_portal_sheet and reco_month_dt is not None and has_date and inv_dt < reco_month_dt:
-            remark = "Previous Month Input" if "Match" in remark else "Previous Period Inv"
-
-        # 4. Section 16(4) time-barred ITC check (portal side only)
-        if is_portal_sheet and has_date:
-            deadline = get_itc_deadline(inv_dt)
-            if deadline is not None and today > deadline:
-                itc_barred = f"YES (was due {deadline.strftime('%d-%b-%Y')})"
-
-        return pd.Series([other_val, diff, remark, itc_barred])
-
-    results = df.apply(row_logic, axis=1)
-    if not results.empty:
-        df[target_col_name] = results[0]
-        df['Difference'] = results[1]
-        df['Remarks'] = results[2]
-        if is_portal_sheet:
-            df['ITC Time-Barred'] = results[3]
-    return df
+        if reco_month_dt is not None:
+            old_mask = (inv_dates < reco_month_dt).to_numpy()
+            is_match = np.char.find(remarks.astype(str), 'Match') >= 0
+            new_cols['Remarks'] = np.where(old_mask & is_match, 'Previous Month Input',
+                                           np.where(old_mask, 'Previous Period Inv', remarks)).astype(object)
+
+        # 4. Section 16(4) time-barred ITC check
+        deadlines = get_itc_deadlines(inv_dates)
+        barred = (deadlines < today).to_numpy()
+        due_text = ('YES (was due ' + deadlines.dt.strftime('%d-%b-%Y') + ')').to_numpy()
+        new_cols['ITC Time-Barred'] = np.where(barred, due_text, '')
+
+    return df.assign(**new_cols)
 
 # ==========================================
 #  SECTION 5: SMART SORTING
 # ==========================================
 
+def _unique_invoices(df):
+    return df['Invoice Number'].astype(str).str.lower().str.strip().drop_duplicates()
+
+def _invoices_long(sheets, names):
+    if not names: return pd.DataFrame(columns=['sheet', 'inv'])
+    return pd.concat([pd.DataFrame({'sheet': k, 'inv': _unique_invoices(sheets[k]).to_numpy()}) for k in names])
+
 def get_smart_sorted_order(portal_dict, books_dict):
-    portal_invs = {}
-    for k, df in portal_dict.items():
-        if 'Invoice Number' in df.columns:
-            unique_invs = set(df['Invoice Number'].astype(str).str.lower().str.strip())
-            portal_invs[k] = unique_invs
-            
-    books_invs = {}
-    for k, df in books_dict.items():
-        if 'Invoice Number' in df.columns:
-            unique_invs = set(df['Invoice Number'].astype(str).str.lower().str.strip())
-            books_invs[k] = unique_invs
-    
+    portal_names = [k for k, df in portal_dict.items() if 'Invoice Number' in df.columns]
+    books_names = [k for k, df in books_dict.items() if 'Invoice Number' in df.columns]
+
+    # Invoice overlap for every (portal, books) sheet pair in one go: each
+    # side's distinct invoices are stacked into a long frame, joined on the
+    # invoice, and the pairs counted -- instead of a set intersection per
+    # pair. Rows follow portal_names, columns books_names.
+    overlap = np.zeros((len(portal_names), len(books_names)), dtype=np.int64)
+    if portal_names and books_names:
+        pairs = _invoices_long(portal_dict, portal_names).merge(
+            _invoices_long(books_dict, books_names), on='inv', suffixes=('_p', '_b'))
+        if len(pairs):
+            overlap = (pairs.groupby(['sheet_p', 'sheet_b'], sort=False).size()
+                       .unstack(fill_value=0)
+                       .reindex(index=portal_names, columns=books_names, fill_value=0)
+                       .to_numpy())
+    portal_row = {k: i for i, k in enumerate(portal_names)}
+    available = np.ones(len(books_names), dtype=bool)
+
     final_order = []
     used_books = set()
 
     for p_name, p_df in portal_dict.items():
         best_match_name = None
         highest_intersect = 0
-        p_set = portal_invs.get(p_name, set())
+        i = portal_row.get(p_name)
 
-        if p_set:
-            for b_name, b_set in books_invs.items():
-                if b_name in used_books: continue
-                common_count = len(p_set.intersection(b_set))
-                if common_count > highest_intersect:
-                    highest_intersect = common_count
-                    best_match_name = b_name
+        if i is not None and available.any():
+            # Books sheets already paired are masked out; argmax takes the
+            # first maximum, so the earliest books sheet wins a tie.
+            scores = np.where(available, overlap[i], -1)
+            best = int(scores.argmax())
+            highest_intersect = int(scores[best])
+            best_match_name = books_names[best]
 
         base_name = p_name[:20].strip() 
         p_sheet_title = f"{base_name} (Portal)"
@@ -498,13 +616,18 @@ def get_smart_sorted_order(portal_dict, books_dict):
             b_sheet_title = f"{base_name} (Books)"
             final_order.append((b_sheet_title, b_df))
             used_books.add(best_match_name)
+            available[best] = False
 
     for b_name, b_df in books_dict.items():
         if b_name not in used_books:
             title = f"{b_name} (Books)"[:31]
             final_order.append((title, b_df))
-            
-    return final_order
+
+    # A paired books sheet is titled from its portal sheet, so a leftover
+    # books sheet (or two portal names sharing their first 20 chars) can
+    # repeat a title
+    titles = unique_sheet_names(title for title, _ in final_order)
+    return [(title, df) for title, (_, df) in zip(titles, final_order)]
 
 # ==========================================
 #  SECTION 6: ITC AVAILABILITY MERGE
@@ -546,8 +669,9 @@ def apply_itc_availability(processed_portal, reference_sheets):
         label = ITC_AVAILABILITY_LABELS.get(sheet_name.strip())
         if not label or 'GSTIN' not in df.columns or 'Invoice Number' not in df.columns:
             continue
-        for _, row in df.iterrows():
-            key = (str(row['GSTIN']).strip().upper(), clean_inv_str(row['Invoice Number']))
+        gstins = df['GSTIN'].astype(str).str.strip().str.upper()
+        invs = clean_inv_series(df['Invoice Number']).where(df['Invoice Number'].notna(), '')
+        for key in zip(gstins, invs):
             if key[1]:
                 availability_map[key] = label
 
@@ -558,10 +682,9 @@ def apply_itc_availability(processed_portal, reference_sheets):
         if not availability_map or 'GSTIN' not in df.columns or 'Invoice Number' not in df.columns:
             df['ITC Availability'] = ''
             continue
-        df['ITC Availability'] = [
-            availability_map.get((str(g).strip().upper(), clean_inv_str(inv)), '')
-            for g, inv in zip(df['GSTIN'], df['Invoice Number'])
-        ]
+        gstins = df['GSTIN'].astype(str).str.strip().str.upper()
+        invs = clean_inv_series(df['Invoice Number']).where(df['Invoice Number'].notna(), '')
+        df['ITC Availability'] = [availability_map.get(key, '') for key in zip(gstins, invs)]
     return processed_portal
 
 # ==========================================
@@ -612,43 +735,48 @@ def compute_reco_data(file_portal, odoo_files_dict, month_str=None):
 
     # 1. Portal Processing -- split into sheets to reconcile vs. ITC
     # reference-only sheets (see ITC_REFERENCE_SHEETS above)
-    xls_p = pd.ExcelFile(file_portal)
-    raw_portal = filter_portal_sheets(xls_p)
-    clean_portal_dict = {}
-    reference_sheets = {}
-    rcm_frames = []
-    for sheet, df_raw in raw_portal.items():
-        df = clean_portal_df(df_raw, sheet)
-        if df.empty: continue
-        if sheet.strip() in ITC_REFERENCE_SHEETS:
-            reference_sheets[sheet] = df
-            continue
-        if 'Reverse Charge' in df.columns:
-            is_rcm = df['Reverse Charge'].astype(str).str.strip().str.lower().isin(['yes', 'y'])
-            if is_rcm.any():
-                rcm_data = df[is_rcm].copy(); rcm_data['Source'] = sheet
-                rcm_frames.append(rcm_data); df = df[~is_rcm]
-        clean_portal_dict[sheet] = df
-    if rcm_frames: clean_portal_dict['RCM Combined'] = pd.concat(rcm_frames, ignore_index=True)
-
-    # 2. Odoo Processing
-    clean_odoo_dict = process_odoo_logic_4files(odoo_files_dict)
+    def load_portal():
+        with pd.ExcelFile(file_portal) as xls_p:
+            raw_portal = filter_portal_sheets(xls_p)
+        clean_portal_dict = {}
+        reference_sheets = {}
+        rcm_frames = []
+        for sheet, df_raw in raw_portal.items():
+            df = clean_portal_df(df_raw, sheet)
+            if df.empty: continue
+            if sheet.strip() in ITC_REFERENCE_SHEETS:
+                reference_sheets[sheet] = df
+                continue
+            if 'Reverse Charge' in df.columns:
+                is_rcm = is_yes_flag(df['Reverse Charge'])
+                if is_rcm.any():
+                    rcm_data = df[is_rcm].copy(); rcm_data['Source'] = sheet
+                    rcm_frames.append(rcm_data); df = df[~is_rcm]
+            clean_portal_dict[sheet] = df
+        if rcm_frames: clean_portal_dict['RCM Combined'] = pd.concat(rcm_frames, ignore_index=True)
+        return clean_portal_dict, reference_sheets
+
+    # 2. Odoo Processing -- independent of the portal file, so both are
+    # read and cleaned side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        portal_future = pool.submit(load_portal)
+        odoo_future = pool.submit(process_odoo_logic_4files, odoo_files_dict)
+        clean_portal_dict, reference_sheets = portal_future.result()
+        clean_odoo_dict = odoo_future.result()
 
     # 3. Indexing
-    books_maps_tuple = generate_lookup_map(clean_odoo_dict)
-    portal_maps_tuple = generate_lookup_map(clean_portal_dict)
-
-    # 4. Apply Logic (Portal Sheets)
-    processed_portal = {}
-    for sheet_name, df in clean_portal_dict.items():
-        df_final = apply_reco_logic(df, books_maps_tuple, 'As per Books', True, reco_dt)
-        processed_portal[sheet_name] = df_final
-
-    # 5. Apply Logic (Books Sheets)
-    processed_books = {}
-    for sheet_name, df in clean_odoo_dict.items():
-        df_final = apply_reco_logic(df, portal_maps_tuple, 'As per Portal', False, None)
-        processed_books[sheet_name] = df_final
+    books_maps_tuple, portal_maps_tuple = generate_lookup_maps(clean_odoo_dict, clean_portal_dict)
+
+    # 4./5. Apply Logic (Portal Sheets, then Books Sheets). The lookup maps
+    # are only read, so every sheet reconciles independently and they're
+    # spread over a small pool; results keep the original sheet order.
+    jobs = [(clean_portal_dict, books_maps_tuple, 'As per Books', True, reco_dt),
+            (clean_odoo_dict, portal_maps_tuple, 'As per Portal', False, None)]
+    with ThreadPoolExecutor(max_workers=RECO_WORKERS) as pool:
+        futures = [{name: pool.submit(apply_reco_logic, df, maps, target, is_portal, dt)
+                    for name, df in sheets.items()}
+                   for sheets, maps, target, is_portal, dt in jobs]
+        processed_portal, processed_books = [{name: f.result() for name, f in fs.items()} for fs in futures]
 
     # 6. ITC Availability merge (portal sheets only)
     processed_portal = apply_itc_availability(processed_portal, reference_sheets)
@@ -663,7 +791,11 @@ def generate_reco_report(file_portal, odoo_files_dict, month_str=None):
     output = BytesIO()
     processed_portal, processed_books, reference_sheets = compute_reco_data(file_portal, odoo_files_dict, month_str)
 
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+    # constant_memory streams each finished row to disk instead of holding
+    # every sheet's cells in memory until save -- see
+    # add_formatting_and_subtotals for the row-order constraint it imposes.
+    with pd.ExcelWriter(output, engine='xlsxwriter',
+                        engine_kwargs={'options': {'constant_memory': True, 'strings_to_numbers': False}}) as writer:
 
         # Vendor Summary (written first so it's the first tab a reviewer sees)
         vendor_summary = generate_vendor_summary(processed_portal)
@@ -1,18 +1,30 @@
 import pandas as pd
 import re
+import math
 import logging
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
 import numpy as np
 from xlsxwriter.utility import xl_col_to_name, xl_rowcol_to_cell
 
+from modules.indirect_tax.gstr_reco_common import (
+    is_yes_flag, dedup_columns, coerce_numeric_cols, sheet_formats, unique_sheet_names, write_data_rows
+)
 from modules.indirect_tax.gstr_period_balance import get_opening_itc, save_closing_itc
 
 # ==========================================
 #  CONFIGURATION & SETTINGS
 # ==========================================
 
-PORTAL_SHEETS_TO_IGNORE = ["Read me"]
+PORTAL_SHEETS_TO_IGNORE = {"Read me"}
+
+# Portal sheets that are dropped when this (1-based) row -- the first data
+# row under the portal's multi-row header -- is blank.
+PORTAL_EMPTY_CHECK_ROW = {
+    "B2B": 7, "B2B-CDNR": 7, "ECO": 7, "ISD": 7, "IMPG": 7, "IMPGSEZ": 7,
+    "B2B (ITC Reversal)": 7, "B2B-DNR": 7, "B2BA": 8, "B2B-CDNRA": 8
+}
 
 # These carry ITC-eligibility info rather than a distinct set of transactions.
 # Kept and shown in the output workbook for reference, but deliberately NOT
@@ -34,6 +46,11 @@ RENAME_MAP = {
     'Invoice Date': 'Invoice date', 'Place of supply': 'Place Of Supply',
     'Supply Attract Reverse Charge': 'Reverse Charge', 'Rate (%)': 'Rate'
 }
+# Lowercased once so each column is a single dict lookup
+LC_RENAME_MAP = {k.lower(): v for k, v in RENAME_MAP.items()}
+
+HEADER_SEARCH_RE = re.compile(r'gstin of supplier|invoice number|note number|bill of entry number')
+INV_CLEAN_RE = re.compile(r'[^a-zA-Z0-9]')
 
 # ==========================================
 #  UTILITIES
@@ -41,10 +58,14 @@ RENAME_MAP = {
 
 def clean_inv_str(s):
     """Standardizes invoice numbers: lowercase, removes special chars."""
-    if pd.isna(s): return ""
-    return re.sub(r'[^a-zA-Z0-9]', '', str(s).lower())
+    # Plain strings (the usual case) skip pd.isna's type dispatch
+    if not isinstance(s, str) and pd.isna(s): return ""
+    return INV_CLEAN_RE.sub('', str(s).lower())
 
 def robust_safe_float(val):
+    # Already-numeric cells (most of them, off read_excel) need no parsing
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val) if val == val else 0.0
     if pd.isna(val) or val == '': return 0.0
     try:
         val_str = str(val).replace(',', '').strip()
@@ -52,6 +73,30 @@ def robust_safe_float(val):
     except (ValueError, TypeError):
         return 0.0
 
+# Column-at-a-time versions of the cleaners above, for the reconciliation
+# core -- same output per cell, without a Python call per cell.
+
+def _clean_distinct(s, clean):
+    """clean(str column) evaluated once per distinct value of s and mapped
+    back by code -- a vendor's GSTIN or a repeated invoice number is only
+    cleaned once however many rows carry it. NaN cells become ""."""
+    codes, uniques = pd.factorize(s.astype(str))
+    out = pd.Series(clean(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)[codes], index=s.index)
+    return out.where(s.notna(), "")
+
+def clean_inv_series(s):
+    return _clean_distinct(s, lambda u: u.str.lower().str.replace(INV_CLEAN_RE, '', regex=True))
+
+def clean_gstin_series(s):
+    return _clean_distinct(s, lambda u: u.str.upper().str.strip()
+                           .str.replace(" ", "", regex=False).str.replace("-", "", regex=False).str[:15])
+
+def safe_float_series(s):
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.astype(float).fillna(0.0)
+    cleaned = s.astype(str).str.replace(',', '', regex=False).str.strip()
+    return pd.to_numeric(cleaned, errors='coerce').astype(float).fillna(0.0)
+
 def get_itc_deadline(invoice_date):
     """Section 16(4): ITC on an invoice must be claimed by 30th November
     following the end of the financial year (Apr-Mar) it belongs to. Returns
@@ -63,8 +108,14 @@ def get_itc_deadline(invoice_date):
     fy_end_year = year + 1 if month >= 4 else year
     return pd.Timestamp(year=fy_end_year, month=11, day=30)
 
+def get_itc_deadlines(invoice_dates):
+    """Column version of get_itc_deadline for a datetime Series; unusable
+    dates come back as NaT."""
+    fy_end_year = invoice_dates.dt.year + (invoice_dates.dt.month >= 4)
+    return pd.to_datetime(pd.DataFrame({'year': fy_end_year, 'month': 11, 'day': 30}), errors='coerce')
+
 def clean_gstin(val):
-    if pd.isna(val): return ""
+    if not isinstance(val, str) and pd.isna(val): return ""
     s = str(val).upper().strip().replace(" ", "").replace("-", "")
     return s[:15] if len(s) >= 15 else s
 
@@ -76,9 +127,48 @@ def clean_date_robust(val):
     except (ValueError, TypeError):
         return None
 
+def clean_date_series(s):
+    """clean_date_robust over a whole column. Each distinct value is parsed
+    once and mapped back by code -- one invoice date covers many rows. Values
+    stay individually parsed on purpose: a single whole-column to_datetime
+    infers one format from the first value and would NaT out the rest of a
+    column that mixes '15/11/2025' with '2025-12-03'."""
+    if s.empty: return s.apply(clean_date_robust)
+    codes, uniques = pd.factorize(s)
+    parsed = np.array([clean_date_robust(v) for v in uniques] + [None], dtype=object)
+    return pd.Series(parsed[codes].tolist(), index=s.index)
+
+def _length_bound(a, b):
+    """Upper bound on SequenceMatcher(None, a, b).ratio() from the lengths
+    alone (what real_quick_ratio() returns), without building the matcher."""
+    total = len(a) + len(b)
+    return 2.0 * min(len(a), len(b)) / total if total else 1.0
+
 def get_similarity_score(a, b):
+    if a == b: return 1.0
+    if _length_bound(a, b) == 0.0: return 0.0
     return SequenceMatcher(None, a, b).ratio()
 
+def is_similar(a, b, threshold):
+    """get_similarity_score(a, b) > threshold. Identical strings and the
+    length-only bound are settled before a SequenceMatcher is even built,
+    then difflib's character-count bound is checked, so most non-matching
+    pairs are rejected without paying for the full ratio()."""
+    if a == b: return 1.0 > threshold
+    if _length_bound(a, b) <= threshold: return False
+    sm = SequenceMatcher(None, a, b)
+    return sm.quick_ratio() > threshold and sm.ratio() > threshold
+
+def lower_cols(df):
+    """(lowercased name, column) pairs for df, built once per frame so
+    several find_col lookups don't each re-lowercase every header."""
+    return [(str(c).lower(), c) for c in df.columns]
+
+def find_col(lc, keywords):
+    """First column (in sheet order) whose lowercased name contains any of
+    keywords; lc comes from lower_cols."""
+    return next((c for name, c in lc if any(k in name for k in keywords)), None)
+
 # ==========================================
 #  EXCEL WRITER LOGIC
 # ==========================================
@@ -87,43 +177,32 @@ def add_formatting(writer, df, sheet_name):
     if df.empty: return
     
     # Safety: Drop duplicate columns before writing to avoid Excel confusion
-    df = df.loc[:, ~df.columns.duplicated()]
-    
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
+    df = dedup_columns(df)
 
     workbook = writer.book
-    worksheet = writer.sheets[sheet_name]
+    worksheet = workbook.add_worksheet(sheet_name)
     (num_rows, num_cols) = df.shape
+    total_row = num_rows + 1
 
-    # Define Formats
-    fmt_header = workbook.add_format({'bold': True, 'bg_color': '#D7E4BC', 'border': 1})
-    fmt_num = workbook.add_format({'bold': True, 'num_format': '#,##0.00'})
-    fmt_red = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006'})
-    fmt_green = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'})
-    fmt_bold = workbook.add_format({'bold': True})
-
-    # Apply Header Formatting
-    for col_num, value in enumerate(df.columns.values):
-        worksheet.write(0, col_num, value, fmt_header)
-        worksheet.set_column(col_num, col_num, 15)
+    # Formats (shared by every sheet of this workbook)
+    fmts = sheet_formats(workbook)
+    fmt_header, fmt_num, fmt_bold = fmts['header'], fmts['number'], fmts['bold']
+    fmt_red, fmt_green, fmt_date = fmts['red'], fmts['green'], fmts['date']
+
+    # generate_reco_report_zoho runs in constant_memory mode, where a row is
+    # flushed as soon as a later one is written, so cells go out strictly top
+    # to bottom (header, data, totals) and sheet-level settings (widths,
+    # autofilter, conditional formats) are declared first. df.to_excel writes
+    # column by column and would lose every earlier row in that mode.
+    worksheet.set_column(0, num_cols - 1, 15)
+    for col_num, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            worksheet.set_column(col_num, col_num, 15, fmt_date)
 
     # Apply Autofilter
     if num_rows > 0:
         worksheet.autofilter(0, 0, num_rows, num_cols - 1)
 
-    # Add Filter Totals Row
-    total_row = num_rows + 1
-    worksheet.write(total_row, 0, 'Filter Total', fmt_bold)
-
-    # Add Subtotals for Financial Columns
-    keywords_to_sum = ['taxable', 'igst', 'cgst', 'sgst', 'cess', 'total', 'difference', 'val', 'rate', 'integrated', 'central', 'state']
-    
-    for col_idx, col_name in enumerate(df.columns):
-        c_name = str(col_name).lower()
-        if any(k in c_name for k in keywords_to_sum) and 'number' not in c_name and 'date' not in c_name and 'id' not in c_name:
-             col_letter = xl_col_to_name(col_idx)
-             worksheet.write_formula(total_row, col_idx, f'=SUBTOTAL(9,{col_letter}2:{col_letter}{total_row})', fmt_num)
-
     # Apply Conditional Formatting
     if 'Remarks' in df.columns:
         rem_idx = df.columns.get_loc('Remarks')
@@ -134,20 +213,31 @@ def add_formatting(writer, df, sheet_name):
         worksheet.conditional_format(rng, {'type': 'text', 'criteria': 'containing', 'value': 'Not', 'format': fmt_red})
         worksheet.conditional_format(rng, {'type': 'text', 'criteria': 'containing', 'value': 'Match', 'format': fmt_green})
 
+    worksheet.write_row(0, 0, list(df.columns.values), fmt_header)
+    write_data_rows(worksheet, df, fmts)
+
+    # Add Filter Totals Row
+    worksheet.write(total_row, 0, 'Filter Total', fmt_bold)
+
+    # Add Subtotals for Financial Columns
+    keywords_to_sum = ['taxable', 'igst', 'cgst', 'sgst', 'cess', 'total', 'difference', 'val', 'rate', 'integrated', 'central', 'state']
+    
+    for col_idx, (c_name, _) in enumerate(lower_cols(df)):
+        if any(k in c_name for k in keywords_to_sum) and 'number' not in c_name and 'date' not in c_name and 'id' not in c_name:
+             col_letter = xl_col_to_name(col_idx)
+             worksheet.write_formula(total_row, col_idx, f'=SUBTOTAL(9,{col_letter}2:{col_letter}{total_row})', fmt_num)
+
 # ==========================================
 #  DATA CLEANERS
 # ==========================================
 
 def _extract_header_dynamically(df_raw):
-    header_idx = -1
-    search_terms = ['gstin of supplier', 'invoice number', 'note number', 'bill of entry number']
-    
-    for i in range(min(10, len(df_raw))):
-        row_str = " ".join(df_raw.iloc[i].astype(str).fillna('').values).lower()
-        if any(term in row_str for term in search_terms):
-            header_idx = i; break
-    
-    if header_idx == -1: return pd.DataFrame()
+    # First 10 rows joined and searched in one go, not one Series per row
+    head = df_raw.head(10).astype(str)
+    row_strs = head.agg(' '.join, axis=1).str.lower() if not head.empty else pd.Series(dtype=str)
+    hits = row_strs.str.contains(HEADER_SEARCH_RE).to_numpy()
+    if not hits.any(): return pd.DataFrame()
+    header_idx = int(hits.argmax())
 
     df_data = df_raw.iloc[header_idx+1:].reset_index(drop=True)
     row1 = df_raw.iloc[header_idx].astype(str).replace('nan', '').str.strip().tolist()
@@ -164,19 +254,11 @@ def _extract_header_dynamically(df_raw):
         df_data.columns = row1
 
     # Rename Columns
-    final_cols = []
-    for col in df_data.columns:
-        mapped = col
-        for k, v in RENAME_MAP.items():
-            if k.lower() == str(col).lower().strip(): mapped = v; break
-        final_cols.append(mapped)
-    df_data.columns = final_cols
+    df_data.columns = [LC_RENAME_MAP.get(str(col).lower().strip(), col) for col in df_data.columns]
 
     # Fix Numerics
     numeric_cols = ['Taxable Value', 'Invoice Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount', 'Cess Amount']
-    for col in numeric_cols:
-        if col in df_data.columns: 
-            df_data[col] = pd.to_numeric(df_data[col], errors='coerce').fillna(0)
+    present = coerce_numeric_cols(df_data, numeric_cols)
 
     # Drop Unwanted
     unwanted = ['period', 'filing date', 'applicable %', 'source', 'irn']
@@ -185,102 +267,103 @@ def _extract_header_dynamically(df_raw):
     if cols_to_drop: 
         df_data.drop(columns=cols_to_drop, inplace=True, errors='ignore')
 
-    # Drop Empty Numeric Columns
-    for col in numeric_cols:
-        if col in df_data.columns and df_data[col].abs().max() == 0: 
-            df_data.drop(columns=[col], inplace=True)
+    # Drop Empty Numeric Columns (one pass over the numeric block)
+    present = [c for c in present if c in df_data.columns]
+    if present and not df_data.empty:
+        nonzero = (df_data[present].to_numpy() != 0).any(axis=0)
+        zero_cols = [c for c, keep in zip(present, nonzero) if not keep]
+        if zero_cols: df_data.drop(columns=zero_cols, inplace=True)
 
-    return df_data.loc[:, ~df_data.columns.duplicated()]
+    return dedup_columns(df_data)
 
 def clean_portal_data(file_content):
-    xls = pd.ExcelFile(file_content)
     cleaned_sheets = {}
     reference_sheets = {}
     rcm_frames = []
 
-    conditional_delete = {
-        "B2B": 7, "B2B-CDNR": 7, "ECO": 7, "ISD": 7, "IMPG": 7, "IMPGSEZ": 7,
-        "B2B (ITC Reversal)": 7, "B2B-DNR": 7, "B2BA": 8, "B2B-CDNRA": 8
-    }
-
-    for sheet in xls.sheet_names:
-        sheet_clean = sheet.strip()
-        if sheet_clean in PORTAL_SHEETS_TO_IGNORE: continue
-
-        try:
-            df_raw = pd.read_excel(xls, sheet_name=sheet, header=None)
-
-            # Empty Check
-            if sheet_clean in conditional_delete:
-                target_idx = conditional_delete[sheet_clean] - 1
-                if len(df_raw) <= target_idx or df_raw.iloc[target_idx].isna().all(): continue
-
-            df = _extract_header_dynamically(df_raw)
-            if df.empty: continue
-
-            if sheet_clean in ITC_REFERENCE_SHEETS:
-                reference_sheets[sheet] = df
+    # One ExcelFile for every sheet (the workbook and its shared strings are
+    # parsed once), released as soon as the sheets have been read
+    with pd.ExcelFile(file_content) as xls:
+        for sheet in xls.sheet_names:
+            sheet_clean = sheet.strip()
+            if sheet_clean in PORTAL_SHEETS_TO_IGNORE: continue
+
+            try:
+                # Empty Check -- only the rows up to the first data row are parsed
+                # for it, so a sheet that gets skipped is never read in full
+                if sheet_clean in PORTAL_EMPTY_CHECK_ROW:
+                    target_idx = PORTAL_EMPTY_CHECK_ROW[sheet_clean] - 1
+                    probe = pd.read_excel(xls, sheet_name=sheet, header=None, nrows=target_idx + 1)
+                    if len(probe) <= target_idx or probe.iloc[target_idx].isna().all(): continue
+
+                df_raw = pd.read_excel(xls, sheet_name=sheet, header=None)
+
+                df = _extract_header_dynamically(df_raw)
+                if df.empty: continue
+
+                if sheet_clean in ITC_REFERENCE_SHEETS:
+                    reference_sheets[sheet] = df
+                    continue
+
+                # Separate RCM
+                if 'Reverse Charge' in df.columns:
+                    is_rcm = is_yes_flag(df['Reverse Charge'])
+                    if is_rcm.any():
+                        rcm_data = df[is_rcm].copy()
+                        rcm_data['Source'] = sheet
+                        rcm_frames.append(rcm_data)
+                        df = df[~is_rcm]
+
+                cleaned_sheets[sheet] = df
+
+            except Exception as e:
+                logging.error(f"Error processing Portal sheet {sheet}: {e}")
                 continue
 
-            # Separate RCM
-            if 'Reverse Charge' in df.columns:
-                is_rcm = df['Reverse Charge'].astype(str).str.strip().str.lower().isin(['yes', 'y'])
-                if is_rcm.any():
-                    rcm_data = df[is_rcm].copy()
-                    rcm_data['Source'] = sheet
-                    rcm_frames.append(rcm_data)
-                    df = df[~is_rcm]
-
-            cleaned_sheets[sheet] = df
-
-        except Exception as e:
-            logging.error(f"Error processing Portal sheet {sheet}: {e}")
-            continue
-
     if rcm_frames:
         cleaned_sheets['RCM Combined'] = pd.concat(rcm_frames, ignore_index=True)
 
     return cleaned_sheets, reference_sheets
 
 def clean_zoho_data(file_content):
-    xls = pd.ExcelFile(file_content)
     sheet_map = {}
 
-    for sheet_name in xls.sheet_names:
-        sheet_lower = sheet_name.lower().strip()
-        if any(x in sheet_lower for x in ZOHO_SHEETS_TO_IGNORE): continue
+    with pd.ExcelFile(file_content) as xls:
+        for sheet_name in xls.sheet_names:
+            sheet_lower = sheet_name.lower().strip()
+            if any(x in sheet_lower for x in ZOHO_SHEETS_TO_IGNORE): continue
         
-        try:
-            # Assume header is on Row 2 (index 1)
-            df = pd.read_excel(xls, sheet_name=sheet_name, header=1)
-            if df.empty: continue
+            try:
+                # Assume header is on Row 2 (index 1)
+                df = pd.read_excel(xls, sheet_name=sheet_name, header=1)
+                if df.empty: continue
             
-            df = df.dropna(how='all', axis=0) 
-            df = df.dropna(how='all', axis=1) 
-            if df.empty: continue
-
-            # Strict Check
-            if 'Invoice Number' in df.columns:
-                if df['Invoice Number'].dropna().empty: continue 
-            elif 'Taxable Value' in df.columns:
-                if df['Taxable Value'].sum() == 0: continue
-            else:
+                df = df.dropna(how='all', axis=0) 
+                df = df.dropna(how='all', axis=1) 
+                if df.empty: continue
+
+                # Strict Check
+                if 'Invoice Number' in df.columns:
+                    if df['Invoice Number'].dropna().empty: continue 
+                elif 'Taxable Value' in df.columns:
+                    if df['Taxable Value'].sum() == 0: continue
+                else:
+                    continue
+
+                df = dedup_columns(df)
+
+                # Cut off at last valid invoice
+                if 'Invoice Number' in df.columns:
+                    last_idx = df['Invoice Number'].last_valid_index()
+                    if last_idx is not None:
+                        df = df.iloc[:last_idx + 1]
+
+                sheet_map[sheet_lower] = {'original_name': sheet_name, 'df': df}
+
+            except Exception as e:
+                logging.warning(f"Error processing Zoho sheet '{sheet_name}': {e}")
                 continue
 
-            df = df.loc[:, ~df.columns.duplicated()]
-
-            # Cut off at last valid invoice
-            if 'Invoice Number' in df.columns:
-                last_idx = df['Invoice Number'].last_valid_index()
-                if last_idx is not None:
-                    df = df.iloc[:last_idx + 1]
-
-            sheet_map[sheet_lower] = {'original_name': sheet_name, 'df': df}
-
-        except Exception as e:
-            logging.warning(f"Error processing Zoho sheet '{sheet_name}': {e}")
-            continue
-
     # Remove RCM invoices from B2B if they exist in both
     if 'b2b' in sheet_map and 'reverse charge' in sheet_map:
         b2b_df = sheet_map['b2b']['df']
@@ -299,107 +382,170 @@ def clean_zoho_data(file_content):
 #  RECONCILIATION CORE
 # ==========================================
 
+def amount_keys(values):
+    """Exact-match keys for a list of amounts: rounded to the paisa, so two
+    amounts that only differ by float noise still hash together."""
+    return np.rint(np.asarray(values, dtype=float) * 100).tolist()
+
+def exact_keys(invs, taxes, gstins):
+    """Pass 1 match keys as a frame (row i = position i). -0.0 amounts are
+    folded into 0.0 so the join agrees with tuple-key equality."""
+    return pd.DataFrame({'inv': pd.Series(invs, dtype=object),
+                         'amt': np.asarray(amount_keys(taxes), dtype=float) + 0.0,
+                         'gstin': pd.Series(gstins, dtype=object)})
+
 def generate_lookup_maps(dataset):
-    candidates = [] 
+    """Returns (cands, index) for reconcile_dataframe.
+
+    cands is struct-of-arrays: one array per field ('inv', 'tax', 'gstin',
+    'igst', 'cgst', 'sgst') plus the shared 'used' flags, so a pass can
+    filter a whole block of candidates in one NumPy expression. index holds
+    the exact-match key frame, candidate positions by invoice number and by
+    amount block, and the GSTIN id lookup -- built once here rather than on
+    every reconcile_dataframe call."""
+    fields = {k: [] for k in ('inv', 'tax', 'gstin', 'igst', 'cgst', 'sgst')}
     for key, val in dataset.items():
         df = val if isinstance(val, pd.DataFrame) else val['df']
         col_inv = 'Invoice Number'
         col_tax = 'Taxable Value'
         if col_inv not in df.columns or col_tax not in df.columns: continue
 
-        col_gstin = next((c for c in df.columns if 'gstin' in c.lower()), None)
-        col_date = next((c for c in df.columns if 'date' in c.lower() and 'invoice' in c.lower()), None)
-        
-        def find_fin_col(keywords):
-            return next((c for c in df.columns if any(k in c.lower() for k in keywords)), None)
-
-        col_igst = find_fin_col(['igst', 'integrated'])
-        col_cgst = find_fin_col(['cgst', 'central'])
-        col_sgst = find_fin_col(['sgst', 'state', 'ut'])
-
-        for idx, row in df.iterrows():
-            candidates.append({
-                'id': f"{key}_{idx}",
-                'used': False,
-                'clean_inv': clean_inv_str(str(row[col_inv]).strip()),
-                'raw_inv': str(row[col_inv]).strip(),
-                'tax_val': robust_safe_float(row[col_tax]), 
-                'gstin': clean_gstin(row[col_gstin]) if col_gstin else "",
-                'date': clean_date_robust(row[col_date]) if col_date else None,
-                'igst': robust_safe_float(row[col_igst]) if col_igst else 0.0,
-                'cgst': robust_safe_float(row[col_cgst]) if col_cgst else 0.0,
-                'sgst': robust_safe_float(row[col_sgst]) if col_sgst else 0.0
-            })
-    return candidates
-
-def reconcile_dataframe(df, candidates, target_col_name, is_portal_sheet, reco_month_dt=None):
+        lc = lower_cols(df)
+        col_gstin = find_col(lc, ['gstin'])
+        col_igst = find_col(lc, ['igst', 'integrated'])
+        col_cgst = find_col(lc, ['cgst', 'central'])
+        col_sgst = find_col(lc, ['sgst', 'state', 'ut'])
+
+        n = len(df)
+        fields['inv'].extend(clean_inv_series(df[col_inv].astype(str).str.strip()).tolist())
+        fields['tax'].extend(safe_float_series(df[col_tax]).tolist())
+        fields['gstin'].extend(clean_gstin_series(df[col_gstin]).tolist() if col_gstin else [""] * n)
+        for field, col in (('igst', col_igst), ('cgst', col_cgst), ('sgst', col_sgst)):
+            fields[field].extend(safe_float_series(df[col]).tolist() if col else [0.0] * n)
+
+    cands = {k: np.array(v, dtype=object if k in ('inv', 'gstin') else float) for k, v in fields.items()}
+    cands['used'] = np.zeros(len(fields['tax']), dtype=bool)
+    # GSTINs as int codes too, so block filters compare integers rather than
+    # 15-char strings; index['gstin_id'] maps a row's GSTIN into that space
+    gstin_ids, gstin_uniques = pd.factorize(cands['gstin'])
+    cands['gstin_id'] = gstin_ids
+
+    def positions(keys):
+        groups = {}
+        for i, k in enumerate(keys):
+            if k is not None: groups.setdefault(k, []).append(i)
+        return {k: np.array(v) for k, v in groups.items()}
+
+    # The amount-windowed passes only ever accept a candidate within 2.0 of
+    # the row's amount, so candidates are also kept sorted by amount (overall
+    # and per GSTIN) for a searchsorted range lookup
+    def by_amount(pos):
+        order = pos[np.argsort(cands['tax'][pos], kind='stable')]
+        return order, cands['tax'][order]
+
+    index = {
+        'exact': exact_keys(fields['inv'], fields['tax'], fields['gstin']),
+        'inv': positions(fields['inv']),
+        'gstin_amount': {g: by_amount(pos) for g, pos in positions(fields['gstin']).items()},
+        'amount': by_amount(np.arange(len(fields['tax']))),
+        'gstin_id': {g: i for i, g in enumerate(gstin_uniques)},
+    }
+    return cands, index
+
+def reconcile_dataframe(df, lookup_maps, target_col_name, is_portal_sheet, reco_month_dt=None):
+    cands, index = lookup_maps
+    c_inv, c_tax, c_gstin, c_used = cands['inv'], cands['tax'], cands['gstin'], cands['used']
+    c_igst, c_cgst, c_sgst = cands['igst'], cands['cgst'], cands['sgst']
+    c_gid, gstin_id = cands['gstin_id'], index['gstin_id']
+    no_cands = np.empty(0, dtype=int)
+
     df[target_col_name] = 0.0
     df['Difference'] = 0.0
     df['Remarks'] = ''
-    df['__matched__'] = False
     if is_portal_sheet:
         df['ITC Time-Barred'] = ''
     
     col_inv = 'Invoice Number'
     col_tax = 'Taxable Value'
-    col_gstin = next((c for c in df.columns if 'gstin' in c.lower()), None)
-    col_date = next((c for c in df.columns if 'date' in c.lower() and 'invoice' in c.lower()), None)
-    
-    def find_col(keywords):
-        return next((c for c in df.columns if any(k in c.lower() for k in keywords)), None)
-    col_igst = find_col(['igst', 'integrated'])
-    col_cgst = find_col(['cgst', 'central'])
-    col_sgst = find_col(['sgst', 'state', 'ut'])
+    lc = lower_cols(df)
+    col_gstin = find_col(lc, ['gstin'])
+    col_date = next((c for name, c in lc if 'date' in name and 'invoice' in name), None)
+    col_igst = find_col(lc, ['igst', 'integrated'])
+    col_cgst = find_col(lc, ['cgst', 'central'])
+    col_sgst = find_col(lc, ['sgst', 'state', 'ut'])
 
     if col_inv not in df.columns: return df
-    if col_date: df[col_date] = df[col_date].apply(clean_date_robust)
-
-    exact_match_index = {}
-    for i, cand in enumerate(candidates):
-        key = (cand['clean_inv'], cand['tax_val'], cand['gstin'])
-        if key not in exact_match_index: exact_match_index[key] = []
-        exact_match_index[key].append(i)
-
-    def get_row_data(row):
-        return {
-            'inv': clean_inv_str(row.get(col_inv, '')),
-            'tax': robust_safe_float(row.get(col_tax)),
-            'gstin': clean_gstin(row.get(col_gstin)) if col_gstin else "",
-            'date': row.get(col_date) if col_date else None,
-            'igst': robust_safe_float(row.get(col_igst)) if col_igst else 0.0,
-            'cgst': robust_safe_float(row.get(col_cgst)) if col_cgst else 0.0,
-            'sgst': robust_safe_float(row.get(col_sgst)) if col_sgst else 0.0
-        }
-
-    def write_match(idx, r, cand, remark, match_val=None):
-        val = match_val if match_val is not None else cand['tax_val']
-        
-        # Rate Diff Check
-        final_remark = remark
-        if cand and "Match" in remark and "Rate Diff" not in remark:
-            row_tax = r['igst'] + r['cgst'] + r['sgst']
-            cand_tax = cand['igst'] + cand['cgst'] + cand['sgst']
-            if abs(r['tax'] - val) < 2.0 and abs(row_tax - cand_tax) > 2.0:
-                 final_remark = "Mismatch (Rate Diff)"
-
-        df.at[idx, target_col_name] = val
-        df.at[idx, 'Difference'] = r['tax'] - val
-        df.at[idx, 'Remarks'] = final_remark
-        df.at[idx, '__matched__'] = True
-        if cand: cand['used'] = True 
+    if col_date: df[col_date] = clean_date_series(df[col_date])
+
+    # Row values never change between passes, so they're cleaned once up
+    # front, a column at a time, and every pass below works off these lists.
+    # Results go into plain arrays that are assigned back as whole columns at
+    # the end, not df.at per cell.
+    n = len(df)
+    def fin(col): return safe_float_series(df[col]).tolist() if col else [0.0] * n
+    rows = [
+        {'inv': inv, 'tax': tax, 'gstin': gstin, 'gid': gstin_id.get(gstin, -1),
+         'igst': igst, 'cgst': cgst, 'sgst': sgst}
+        for inv, tax, gstin, igst, cgst, sgst in zip(
+            clean_inv_series(df[col_inv]).tolist(),
+            fin(col_tax if col_tax in df.columns else None),
+            clean_gstin_series(df[col_gstin]).tolist() if col_gstin else [""] * n,
+            fin(col_igst), fin(col_cgst), fin(col_sgst))
+    ]
+    row_tax = np.array([r['tax'] for r in rows], dtype=float)
+
+    def nearby(r, same_gstin=False):
+        """Unused candidates within 2.0 of the row's amount, in original
+        candidate order. Each amount-sorted block (GSTIN-compatible blocks
+        only) is cut down to a slightly wider window by binary search, then
+        the exact 2.0 test is applied."""
+        if not math.isfinite(r['tax']):
+            pos = np.arange(len(c_tax))
+        else:
+            if same_gstin: blocks = [index['gstin_amount'].get(r['gstin'])]
+            elif r['gstin']: blocks = [index['gstin_amount'].get(g) for g in (r['gstin'], "")]
+            else: blocks = [index['amount']]
+            parts = []
+            for block in blocks:
+                if block is None: continue
+                order, sorted_tax = block
+                lo = np.searchsorted(sorted_tax, r['tax'] - 3.0, side='left')
+                hi = np.searchsorted(sorted_tax, r['tax'] + 3.0, side='right')
+                parts.append(order[lo:hi])
+            pos = np.sort(np.concatenate(parts)) if parts else no_cands
+        return pos[~c_used[pos] & ~(np.abs(r['tax'] - c_tax[pos]) > 2.0)]
+
+    target = np.zeros(n)
+    diff = np.zeros(n)
+    remarks = np.full(n, '', dtype=object)
+    matched = np.zeros(n, dtype=bool)
+    # Candidate each single-candidate "Match" row was paired with, for the
+    # Rate Diff check run over all of them at once after the passes (-1: none)
+    rate_ci = np.full(n, -1)
+
+    def write_match(i, r, ci, remark, match_val=None):
+        val = match_val if match_val is not None else c_tax[ci]
+        if ci is not None and "Match" in remark: rate_ci[i] = ci
+        target[i] = val
+        diff[i] = r['tax'] - val
+        remarks[i] = remark
+        matched[i] = True
+        if ci is not None: c_used[ci] = True 
 
     # --- RECONCILIATION PASSES ---
-    for idx, row in df.iterrows():
-        if df.at[idx, '__matched__']: continue
-        r = get_row_data(row)
-        if not r['inv']: continue
-        key = (r['inv'], r['tax'], r['gstin'])
-        if key in exact_match_index:
-            for cand_idx in exact_match_index[key]:
-                cand = candidates[cand_idx]
-                if not cand['used']:
-                    write_match(idx, r, cand, "Match")
-                    break
+    # Pass 1 (exact) as one join: the k-th row carrying an (invoice, amount,
+    # GSTIN) key takes the k-th still-unused candidate with that key -- the
+    # same pairing as probing the key row by row in sheet order.
+    key_cols = ['inv', 'amt', 'gstin']
+    row_keys = exact_keys([r['inv'] for r in rows], row_tax, [r['gstin'] for r in rows])
+    row_keys = row_keys[row_keys['inv'] != ""]
+    free = index['exact'][~c_used]
+    if len(row_keys) and len(free):
+        row_keys = row_keys.assign(k=row_keys.groupby(key_cols, sort=False).cumcount(), i=row_keys.index)
+        free = free.assign(k=free.groupby(key_cols, sort=False).cumcount(), ci=free.index)
+        pairs = row_keys.merge(free, on=key_cols + ['k'])
+        for i, ci in zip(pairs['i'].tolist(), pairs['ci'].tolist()):
+            write_match(i, rows[i], ci, "Match")
 
     # Pass 1.5: same invoice number + GSTIN, but the amount doesn't match.
     # Every other pass below requires the amount to already be close before
@@ -410,103 +556,118 @@ def reconcile_dataframe(df, candidates, target_col_name, is_portal_sheet, reco_m
     # "Mismatch". Invoice number + GSTIN identity is reliable enough that it
     # should win regardless of amount, same as the Odoo reco engine already
     # does.
-    for idx, row in df.iterrows():
-        if df.at[idx, '__matched__']: continue
-        r = get_row_data(row)
+    for i, r in enumerate(rows):
+        if matched[i]: continue
         if not r['inv']: continue
-        for cand in candidates:
-            if cand['used'] or cand['clean_inv'] != r['inv']: continue
-            if r['gstin'] and cand['gstin'] and r['gstin'] != cand['gstin']: continue
-            write_match(idx, r, cand, "Mismatch")
+        for ci in index['inv'].get(r['inv'], no_cands):
+            if c_used[ci]: continue
+            if r['gstin'] and c_gstin[ci] and r['gstin'] != c_gstin[ci]: continue
+            write_match(i, r, ci, "Mismatch")
             break
 
-    for idx, row in df.iterrows():
-        if df.at[idx, '__matched__']: continue
-        r = get_row_data(row)
+    for i, r in enumerate(rows):
+        if matched[i]: continue
         if not r['inv'] or not r['gstin']: continue
-        potential_group = [c for c in candidates if not c['used'] and c['clean_inv'] == r['inv'] and c['gstin'] == r['gstin']]
+        pos = index['inv'].get(r['inv'], no_cands)
+        potential_group = pos[~c_used[pos] & (c_gid[pos] == r['gid'])]
         if len(potential_group) > 1:
-            group_sum = sum(c['tax_val'] for c in potential_group)
+            group_sum = sum(c_tax[potential_group].tolist())
             if abs(r['tax'] - group_sum) <= 2.0:
-                for c in potential_group: c['used'] = True
-                write_match(idx, r, None, "Match(Grouped)", group_sum)
-
-    for idx, row in df.iterrows():
-        if df.at[idx, '__matched__']: continue
-        r = get_row_data(row)
+                c_used[potential_group] = True
+                write_match(i, r, None, "Match(Grouped)", group_sum)
+
+    # Typo verdicts per (row, candidate) invoice pair, kept for this call
+    # only -- the same pair recurs across rows, but invoice numbers aren't
+    # held once the reconciliation is done. The pair isn't reordered:
+    # difflib's ratio isn't symmetric.
+    similar = {}
+    for i, r in enumerate(rows):
+        if matched[i]: continue
         if not r['inv']: continue
-        for cand in candidates:
-            if cand['used']: continue
-            if abs(r['tax'] - cand['tax_val']) > 2.0: continue
-            if r['gstin'] and cand['gstin'] and r['gstin'] != cand['gstin']: continue
-            if get_similarity_score(r['inv'], cand['clean_inv']) > 0.85:
-                write_match(idx, r, cand, "Match(Typo)"); break
+        for ci in nearby(r):
+            if r['gstin'] and c_gstin[ci] and r['gstin'] != c_gstin[ci]: continue
+            pair = (r['inv'], c_inv[ci])
+            hit = similar.get(pair)
+            if hit is None: hit = similar[pair] = is_similar(pair[0], pair[1], 0.85)
+            if hit:
+                write_match(i, r, ci, "Match(Typo)"); break
     
-    for idx, row in df.iterrows():
-        if df.at[idx, '__matched__']: continue
-        r = get_row_data(row)
+    for i, r in enumerate(rows):
+        if matched[i]: continue
         if not r['inv']: continue
-        for cand in candidates:
-            if cand['used']: continue
-            if abs(r['tax'] - cand['tax_val']) > 2.0: continue
-            if abs(r['igst'] - cand['igst']) > 2.0: continue
-            if r['gstin'] and cand['gstin'] and r['gstin'] != cand['gstin']: continue
-            c_inv, r_inv = cand['clean_inv'], r['inv']
-            if (len(r_inv)>3 and len(c_inv)>3) and ((r_inv in c_inv) or (c_inv in r_inv)):
-                write_match(idx, r, cand, "Match(Fuzzy)"); break
+        pos = nearby(r)
+        for ci in pos[~(np.abs(r['igst'] - c_igst[pos]) > 2.0)]:
+            if r['gstin'] and c_gstin[ci] and r['gstin'] != c_gstin[ci]: continue
+            c_inv_i, r_inv = c_inv[ci], r['inv']
+            if (len(r_inv)>3 and len(c_inv_i)>3) and ((r_inv in c_inv_i) or (c_inv_i in r_inv)):
+                write_match(i, r, ci, "Match(Fuzzy)"); break
 
     for strict in [True, False]:
         remark_lbl = "Match(GSTIN-Strict)" if strict else "Match(GSTIN-Loose)"
-        for idx, row in df.iterrows():
-            if df.at[idx, '__matched__']: continue
-            r = get_row_data(row)
+        for i, r in enumerate(rows):
+            if matched[i]: continue
             if not r['gstin']: continue
-            for cand in candidates:
-                if cand['used'] or cand['gstin'] != r['gstin']: continue
-                if abs(r['tax'] - cand['tax_val']) > 2.0: continue
-                if strict and (abs(r['igst'] - cand['igst']) > 2.0 or abs(r['cgst'] - cand['cgst']) > 2.0): continue
-                write_match(idx, r, cand, remark_lbl); break
+            pos = nearby(r, same_gstin=True)
+            pos = pos[c_gid[pos] == r['gid']]
+            if strict: pos = pos[~(np.abs(r['igst'] - c_igst[pos]) > 2.0) & ~(np.abs(r['cgst'] - c_cgst[pos]) > 2.0)]
+            if len(pos): write_match(i, r, pos[0], remark_lbl)
     
-    unmatched_indices = df[~df['__matched__']].index
-    if not unmatched_indices.empty and col_gstin:
-        unmatched_df = df.loc[unmatched_indices].copy()
-        active_gstins = unmatched_df[col_gstin].dropna().apply(clean_gstin).unique()
-        for gstin in active_gstins:
-            if not gstin: continue
-            df_group_indices = unmatched_df[unmatched_df[col_gstin].apply(clean_gstin) == gstin].index
-            my_sum = df.loc[df_group_indices, col_tax].apply(robust_safe_float).sum()
-            cand_group = [c for c in candidates if not c['used'] and c['gstin'] == gstin]
-            cand_sum = sum(c['tax_val'] for c in cand_group)
-            if abs(my_sum - cand_sum) <= 5.0 and my_sum > 0:
-                for idx in df_group_indices:
-                    df.at[idx, target_col_name] = df.at[idx, col_tax]
-                    df.at[idx, 'Difference'] = 0.0
-                    df.at[idx, 'Remarks'] = "Match(Consolidated)"; df.at[idx, '__matched__'] = True
-                for c in cand_group: c['used'] = True
+    unmatched = np.flatnonzero(~matched)
+    if unmatched.size and col_gstin:
+        # Unmatched rows and unused candidates are both totalled per GSTIN in
+        # one bincount each; a GSTIN whose totals agree within 5.0 is settled
+        # as a whole. GSTINs are disjoint, so the groups can't interact.
+        g_codes, g_uniques = pd.factorize(np.array([rows[i]['gstin'] for i in unmatched], dtype=object))
+        my_sums = np.bincount(g_codes, weights=row_tax[unmatched], minlength=len(g_uniques))
+        free = ~c_used
+        # trailing 0.0 is what a GSTIN with no candidates (id -1) picks up
+        free_sums = np.append(np.bincount(c_gid[free], weights=c_tax[free], minlength=len(gstin_id)), 0.0)
+        g_ids = np.array([gstin_id.get(g, -1) for g in g_uniques], dtype=int)
+        cand_sums = free_sums[g_ids]
+        settled = (np.abs(my_sums - cand_sums) <= 5.0) & (my_sums > 0) & (g_uniques != "")
+        if settled.any():
+            hit = unmatched[settled[g_codes]]
+            # Portal amounts are already numeric; Zoho ones are taken as-is
+            raw_tax = df[col_tax].to_numpy()
+            if target.dtype != object and raw_tax.dtype == object: target = target.astype(object)
+            target[hit] = raw_tax[hit]
+            diff[hit] = 0.0
+            remarks[hit] = "Match(Consolidated)"; matched[hit] = True
+            c_used[np.isin(c_gid, g_ids[settled])] = True
+
+    # Rate Diff Check: taxable value agrees but the total tax doesn't
+    checked = np.flatnonzero(rate_ci >= 0)
+    if checked.size:
+        ci = rate_ci[checked]
+        row_gst = np.array([rows[i]['igst'] + rows[i]['cgst'] + rows[i]['sgst'] for i in checked.tolist()], dtype=float)
+        cand_gst = c_igst[ci] + c_cgst[ci] + c_sgst[ci]
+        rate_diff = (np.abs(row_tax[checked] - c_tax[ci]) < 2.0) & (np.abs(row_gst - cand_gst) > 2.0)
+        remarks[checked[rate_diff]] = "Mismatch (Rate Diff)"
 
     # Cleanup
-    for idx, row in df.iterrows():
-        if not df.at[idx, '__matched__']:
-            df.at[idx, 'Difference'] = robust_safe_float(row[col_tax])
-            remark = "Not in Books" if is_portal_sheet else "Not on Portal"
-            if is_portal_sheet and reco_month_dt and col_date:
-                curr_date = clean_date_robust(row[col_date])
-                if pd.notnull(curr_date) and curr_date < reco_month_dt: remark = "Previous Period Inv"
-            df.at[idx, 'Remarks'] = remark
+    unmatched = ~matched
+    diff[unmatched] = row_tax[unmatched]
+    remarks[unmatched] = "Not in Books" if is_portal_sheet else "Not on Portal"
+
+    if is_portal_sheet and col_date:
+        inv_dates = pd.to_datetime(df[col_date], errors='coerce')
+        if reco_month_dt: remarks[unmatched & (inv_dates < reco_month_dt).to_numpy()] = "Previous Period Inv"
 
         # Section 16(4) time-barred ITC check (portal side only)
-        if is_portal_sheet and col_date:
-            inv_dt = clean_date_robust(row[col_date])
-            if pd.notnull(inv_dt):
-                deadline = get_itc_deadline(inv_dt)
-                if deadline is not None and pd.Timestamp.now().normalize() > deadline:
-                    df.at[idx, 'ITC Time-Barred'] = f"YES (was due {deadline.strftime('%d-%b-%Y')})"
-
-    df.drop(columns=['__matched__'], inplace=True, errors='ignore')
-    cess_cols = [c for c in df.columns if 'cess' in c.lower()]
-    for c_col in cess_cols:
+        deadlines = get_itc_deadlines(inv_dates)
+        barred = (deadlines < pd.Timestamp.now().normalize()).to_numpy()
+        due_text = ('YES (was due ' + deadlines.dt.strftime('%d-%b-%Y') + ')').to_numpy()
+        df['ITC Time-Barred'] = np.where(barred, due_text, '')
+
+    df[target_col_name] = pd.Series(target, index=df.index).infer_objects()
+    df['Difference'] = diff
+    df['Remarks'] = remarks
+    # Cess columns that total zero are dropped, all summed in one pass
+    cess_cols = list(dict.fromkeys(c for name, c in lc if 'cess' in name))
+    if cess_cols:
         try:
-            if pd.to_numeric(df[c_col], errors='coerce').fillna(0).sum() == 0: df.drop(columns=[c_col], inplace=True)
+            cess_sums = df[cess_cols].apply(pd.to_numeric, errors='coerce').fillna(0).sum()
+            df.drop(columns=cess_sums.index[cess_sums == 0], inplace=True)
         except (ValueError, TypeError):
             pass
     return df
@@ -542,18 +703,33 @@ def compute_reco_data_zoho(file_portal, file_zoho, month_str=None):
         except (ValueError, TypeError) as e:
             logging.warning(f"Could not parse reconciliation month '{month_str}': {e}")
 
-    portal_data, reference_sheets = clean_portal_data(file_portal)
-    zoho_data = clean_zoho_data(file_zoho)
+    # The two workbooks are independent, so they're parsed side by side.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        portal_future = pool.submit(clean_portal_data, file_portal)
+        zoho_future = pool.submit(clean_zoho_data, file_zoho)
+        portal_data, reference_sheets = portal_future.result()
+        zoho_data = zoho_future.result()
 
     books_maps = generate_lookup_maps(zoho_data)
     portal_maps = generate_lookup_maps(portal_data)
 
-    processed_portal_dfs = {}
-    for sheet, df in portal_data.items():
-        processed_portal_dfs[sheet] = reconcile_dataframe(df, books_maps, 'As per Books', True, reco_dt)
+    # Within a side the sheets stay sequential: every sheet consumes
+    # candidates from the same shared pool, in sheet order. The two sides
+    # share nothing once both maps are built (portal sheets only draw on
+    # books_maps, books sheets only on portal_maps), so they run side by side.
+    def reconcile_portal():
+        return {sheet: reconcile_dataframe(df, books_maps, 'As per Books', True, reco_dt)
+                for sheet, df in portal_data.items()}
+
+    def reconcile_books():
+        for key, data in zoho_data.items():
+            data['df'] = reconcile_dataframe(data['df'], portal_maps, 'As per Portal', False)
 
-    for key, data in zoho_data.items():
-        data['df'] = reconcile_dataframe(data['df'], portal_maps, 'As per Portal', False)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        portal_future = pool.submit(reconcile_portal)
+        books_future = pool.submit(reconcile_books)
+        processed_portal_dfs = portal_future.result()
+        books_future.result()
 
     return processed_portal_dfs, zoho_data, reference_sheets
 
@@ -562,9 +738,15 @@ def compute_reco_data_zoho(file_portal, file_zoho, month_str=None):
 # ==========================================
 
 def calculate_smart_offset(liability, credit):
-    """Implements GST Section 49 Payment Rules."""
-    L = liability.copy() 
-    C = credit.copy()
+    """Implements GST Section 49 Payment Rules.
+
+    Worked in whole paise so the chain of set-offs can't accumulate float
+    drift (e.g. a 0.30000000000000004 balance carried forward); amounts come
+    back in rupees. Non-finite amounts (a "nan"/"inf" typed into the
+    dashboard form) count as 0 -- they have no paise value."""
+    def paise(v): return int(round(v * 100)) if math.isfinite(v) else 0
+    L = {k: paise(v) for k, v in liability.items()}
+    C = {k: paise(v) for k, v in credit.items()}
     
     paid = {'i_i':0, 'i_c':0, 'i_s':0, 'c_c':0, 'c_i':0, 's_s':0, 's_i':0}
     
@@ -598,7 +780,12 @@ def calculate_smart_offset(liability, credit):
         use = min(L['i'], C['s'])
         paid['s_i'] = use; L['i'] -= use; C['s'] -= use
 
-    return paid, L, C
+    def rupees(d): return {k: v / 100 for k, v in d.items()}
+    return rupees(paid), rupees(L), rupees(C)
+
+# Master Dashboard rows whose IGST/CGST/SGST cells are live formulas
+DASHBOARD_FORMULA_ROWS = ("Total Liability", "Net ITC", "Current Month ITC", "Total Credit",
+                          "NET PAYABLE", "BALANCE CREDIT")
 
 def generate_master_dashboard(writer, portal_dict, books_dict, manual_inputs):
     """Returns the closing ITC balance (bal_credit: {'i','c','s'}) so a
@@ -618,40 +805,48 @@ def generate_master_dashboard(writer, portal_dict, books_dict, manual_inputs):
         'rcm_urd': {'i':0.0, 'c':0.0, 's':0.0}
     }
     
-    def get_t(row, df):
-        def f(k): return next((c for c in df.columns if any(x in c.lower() for x in k)), None)
-        ci, cc, cs = f(['igst', 'integrated']), f(['cgst', 'central']), f(['sgst', 'state', 'ut'])
-        return robust_safe_float(row.get(ci)), robust_safe_float(row.get(cc)), robust_safe_float(row.get(cs))
+    def tax_totals(df, rows=None):
+        """IGST/CGST/SGST column totals of df, over the rows in the boolean
+        mask `rows` if given -- a column sum each, not a row loop."""
+        lc = lower_cols(df)
+        totals = []
+        for col in (find_col(lc, ['igst', 'integrated']), find_col(lc, ['cgst', 'central']), find_col(lc, ['sgst', 'state', 'ut'])):
+            if not col: totals.append(0.0); continue
+            vals = safe_float_series(df[col]).to_numpy()
+            totals.append(float(vals[rows].sum() if rows is not None else vals.sum()))
+        return totals
+
+    def add(bucket, totals, mult):
+        for k, v in zip(['i', 'c', 's'], totals): sums[bucket][k] += v*mult
 
     # Portal Loop
     for name, df in portal_dict.items():
-        col_rcm = next((c for c in df.columns if 'reverse' in c.lower()), None)
+        col_rcm = find_col(lower_cols(df), ['reverse'])
         is_cn = 'cdnr' in name.lower() or 'credit' in name.lower()
         mult = -1 if is_cn else 1
-        for _, r in df.iterrows():
-            if is_cn and "Not in Books" in str(r.get('Remarks', '')): continue
-            i, c, s = get_t(r, df)
-            if str(r.get(col_rcm, '')).lower() in ['y', 'yes']:
-                sums['rcm_reg']['i'] += i*mult; sums['rcm_reg']['c'] += c*mult; sums['rcm_reg']['s'] += s*mult
-            else:
-                sums['all_other']['i'] += i*mult; sums['all_other']['c'] += c*mult; sums['all_other']['s'] += s*mult
+        if is_cn and 'Remarks' in df.columns:
+            df = df[~df['Remarks'].astype(str).str.contains("Not in Books", regex=False)]
+        is_rcm = df[col_rcm].astype(str).str.lower().isin(['y', 'yes']).to_numpy() if col_rcm else np.zeros(len(df), dtype=bool)
+        add('rcm_reg', tax_totals(df, is_rcm), mult)
+        add('all_other', tax_totals(df, ~is_rcm), mult)
 
     # Books Loop
     for name, data in books_dict.items():
         if any(x in name.lower() for x in ['b2bur', 'unregistered', 'urd']):
-            df = data['df']
             mult = -1 if 'credit' in name.lower() else 1
-            for _, r in df.iterrows():
-                i, c, s = get_t(r, df)
-                sums['rcm_urd']['i'] += i*mult; sums['rcm_urd']['c'] += c*mult; sums['rcm_urd']['s'] += s*mult
+            add('rcm_urd', tax_totals(data['df']), mult)
 
     # RCM & Net ITC
     tot_rcm = {k: sums['rcm_reg'][k] + sums['rcm_urd'][k] for k in ['i','c','s']}
     net_itc = {k: tot_rcm[k] + sums['all_other'][k] for k in ['i','c','s']}
 
     # --- 2. CALCULATE PAYMENT (SMART OFFSET) ---
-    sales = manual_inputs.get('sales', {'igst':0, 'cgst':0, 'sgst':0})
-    op = manual_inputs.get('opening', {'igst':0, 'cgst':0, 'sgst':0})
+    # A "nan"/"inf" typed into the form (float() accepts both) is taken as 0
+    # here, once, so the set-off and the dashboard cells see the same figure
+    # -- xlsxwriter's write_number rejects non-finite numbers outright.
+    def finite(v): return v if math.isfinite(v) else 0.0
+    sales = {k: finite(v) for k, v in manual_inputs.get('sales', {'igst':0, 'cgst':0, 'sgst':0}).items()}
+    op = {k: finite(v) for k, v in manual_inputs.get('opening', {'igst':0, 'cgst':0, 'sgst':0}).items()}
     
     L_fwd = {'i': sales['igst'], 'c': sales['cgst'], 's': sales['sgst']}
     C_avail = {
@@ -707,10 +902,11 @@ def generate_master_dashboard(writer, portal_dict, books_dict, manual_inputs):
 
     df = pd.DataFrame(data, columns=["Particulars", "Details", "IGST", "CGST", "SGST", "Total"])
     sheet_name = "Master Dashboard"
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
     
     # --- 4. FORMATTING & FORMULAS ---
-    wb = writer.book; ws = writer.sheets[sheet_name]
+    # Every non-blank cell is written explicitly below, one row at a time,
+    # so the sheet is safe under constant_memory (no df.to_excel pass).
+    wb = writer.book; ws = wb.add_worksheet(sheet_name)
     
     s_head = wb.add_format({'bold':True, 'bg_color':'#2F4F4F', 'font_color':'white', 'border':1})
     s_sub = wb.add_format({'bold':True, 'bg_color':'#DCDCDC', 'border':1})
@@ -739,7 +935,11 @@ def generate_master_dashboard(writer, portal_dict, books_dict, manual_inputs):
         if "OFFSET" in desc: ws.merge_range(xl_r, 0, xl_r, 5, desc, s_sub); continue
         if "FINAL CHALLAN" in desc: ws.merge_range(xl_r, 0, xl_r, 5, desc, s_final); continue
 
-        for col_idx in [2, 3, 4]: 
+        # Plain-value rows go out in one write_row; only the formula rows
+        # below need a cell at a time
+        formula_cols = [2, 3, 4] if any(k in desc for k in DASHBOARD_FORMULA_ROWS) else []
+        if not formula_cols: ws.write_row(xl_r, 2, row[2:5], s_blue if "Paid by" in desc else s_num)
+        for col_idx in formula_cols:
             if "Total Liability" in desc:
                 r_1 = xl_rowcol_to_cell(r_idx - 2 + 1, col_idx)
                 r_2 = xl_rowcol_to_cell(r_idx - 1 + 1, col_idx)
@@ -778,101 +978,112 @@ def generate_master_dashboard(writer, portal_dict, books_dict, manual_inputs):
                 r_off_start = xl_rowcol_to_cell(18 + 1, col_idx)
                 r_off_end = xl_rowcol_to_cell(20 + 1, col_idx)
                 ws.write_formula(xl_r, col_idx, f"=MAX(0, {r_cred}-SUM({r_off_start}:{r_off_end}))", s_green); continue
-            ws.write(xl_r, col_idx, row[col_idx], s_blue if "Paid by" in desc else s_num)
 
         cell_i = xl_rowcol_to_cell(xl_r, 2)
         cell_s = xl_rowcol_to_cell(xl_r, 4)
         style_tot = s_red if "NET PAYABLE" in desc else (s_green if "BALANCE" in desc else s_bold_num)
         ws.write_formula(xl_r, 5, f"=SUM({cell_i}:{cell_s})", style_tot)
-        ws.write(xl_r, 0, row[0], s_num)
-        ws.write(xl_r, 1, row[1], s_num)
+        ws.write_row(xl_r, 0, row[:2], s_num)
 
     return {'igst': bal_credit['i'], 'cgst': bal_credit['c'], 'sgst': bal_credit['s']}
 
 def generate_vendor_summary(writer, portal_dict, books_dict):
-    stats = {}
     def find_cols_robust(df):
-        gstin = next((c for c in df.columns if 'gstin' in c.lower()), None)
-        name = next((c for c in df.columns if any(k in c.lower() for k in ['vendor', 'trade', 'party', 'name'])), None)
-        tax = next((c for c in df.columns if 'taxable' in c.lower()), None)
-        igst = next((c for c in df.columns if any(k in c.lower() for k in ['igst', 'integrated'])), None)
-        cgst = next((c for c in df.columns if any(k in c.lower() for k in ['cgst', 'central'])), None)
-        sgst = next((c for c in df.columns if any(k in c.lower() for k in ['sgst', 'state'])), None)
+        lc = lower_cols(df)
+        gstin = find_col(lc, ['gstin'])
+        name = find_col(lc, ['vendor', 'trade', 'party', 'name'])
+        tax = find_col(lc, ['taxable'])
+        igst = find_col(lc, ['igst', 'integrated'])
+        cgst = find_col(lc, ['cgst', 'central'])
+        sgst = find_col(lc, ['sgst', 'state'])
         return gstin, name, tax, igst, cgst, sgst
 
-    def process(d_dict, source):
+    # Every sheet is cut down to GSTIN, name and signed amounts, stacked
+    # (portal first, then books) and summed per GSTIN in one groupby
+    def collect(d_dict, pre):
+        parts = []
         for name, data in d_dict.items():
             df = data if isinstance(data, pd.DataFrame) else data['df']
             g, n, t, i, c, s = find_cols_robust(df)
             if not g or not t: continue
             mult = -1 if ('cdnr' in name.lower() or 'credit' in name.lower()) else 1
-            for _, r in df.iterrows():
-                gst = clean_gstin(r[g])
-                if not gst: continue
-                if gst not in stats:
-                    stats[gst] = {k:0.0 for k in ['p_tax','p_i','p_c','p_s','b_tax','b_i','b_c','b_s']}
-                    stats[gst]['name'] = str(r.get(n, 'Unknown')).strip()
-                if stats[gst]['name'] in ['Unknown', 'nan', ''] and n:
-                    stats[gst]['name'] = str(r.get(n, '')).strip()
-                pre = 'p_' if source == 'portal' else 'b_'
-                stats[gst][pre+'tax'] += robust_safe_float(r.get(t,0))*mult
-                stats[gst][pre+'i'] += robust_safe_float(r.get(i,0))*mult
-                stats[gst][pre+'c'] += robust_safe_float(r.get(c,0))*mult
-                stats[gst][pre+'s'] += robust_safe_float(r.get(s,0))*mult
-
-    process(portal_dict, 'portal')
-    process(books_dict, 'books')
-
-    summ = []
-    for g, d in stats.items():
-        diff = d['b_tax'] - d['p_tax']
-        status = "Matched"
-        if abs(diff) < 2: status = "✅ Fully Matched"
-        elif d['p_tax'] == 0: status = "❓ Not in Portal"
-        elif d['b_tax'] == 0: status = "❌ Not in Books"
-        elif diff > 0: status = "⚠️ Excess in Books"
-        else: status = "💰 Unclaimed in Portal"
-        summ.append([g, d['name'], d['p_tax'], d['p_i'], d['p_c'], d['p_s'], d['b_tax'], d['b_i'], d['b_c'], d['b_s'], diff, status])
-    
+            def amt(col): return safe_float_series(df[col]).to_numpy() * mult if col else 0.0
+            parts.append(pd.DataFrame({
+                'GSTIN': clean_gstin_series(df[g]).to_numpy(),
+                'Name': df[n].astype(str).str.strip().to_numpy() if n else None,
+                pre+'tax': amt(t), pre+'i': amt(i), pre+'c': amt(c), pre+'s': amt(s),
+            }))
+        return parts
+
     cols = ['GSTIN', 'Name', 'Portal Taxable', 'P-IGST', 'P-CGST', 'P-SGST', 'Books Taxable', 'B-IGST', 'B-CGST', 'B-SGST', 'Diff', 'Status']
-    df_s = pd.DataFrame(summ, columns=cols)
+    amount_cols = ['p_tax', 'p_i', 'p_c', 'p_s', 'b_tax', 'b_i', 'b_c', 'b_s']
+    parts = collect(portal_dict, 'p_') + collect(books_dict, 'b_')
+    frame_cols = ['GSTIN', 'Name'] + amount_cols
+    rows = pd.concat(parts, ignore_index=True).reindex(columns=frame_cols) if parts else pd.DataFrame(columns=frame_cols)
+    rows = rows[rows['GSTIN'] != '']
+
+    by_gstin = rows.groupby('GSTIN', sort=False)
+    d = by_gstin[amount_cols].sum().astype(float)
+    # A vendor's name is the first real one seen; failing that, the last
+    # placeholder ('nan'/'') read from a name column, else 'Unknown'
+    placeholder = rows['Name'].isin(['Unknown', 'nan', ''])
+    names = rows['Name'].where(~placeholder).groupby(rows['GSTIN'], sort=False).first()
+    fallback = by_gstin['Name'].last()
+    d['name'] = names.reindex(d.index).fillna(fallback.reindex(d.index)).fillna('Unknown')
+
+    diff = d['b_tax'] - d['p_tax']
+    status = np.select(
+        [diff.abs() < 2, d['p_tax'] == 0, d['b_tax'] == 0, diff > 0],
+        ["✅ Fully Matched", "❓ Not in Portal", "❌ Not in Books", "⚠️ Excess in Books"],
+        default="💰 Unclaimed in Portal")
+
+    df_s = pd.DataFrame({
+        'GSTIN': d.index.to_numpy(dtype=object), 'Name': d['name'].to_numpy(dtype=object),
+        'Portal Taxable': d['p_tax'].to_numpy(), 'P-IGST': d['p_i'].to_numpy(), 'P-CGST': d['p_c'].to_numpy(), 'P-SGST': d['p_s'].to_numpy(),
+        'Books Taxable': d['b_tax'].to_numpy(), 'B-IGST': d['b_i'].to_numpy(), 'B-CGST': d['b_c'].to_numpy(), 'B-SGST': d['b_s'].to_numpy(),
+        'Diff': diff.to_numpy(), 'Status': status.astype(object),
+    }, columns=cols)
     add_formatting(writer, df_s, "Vendor Summary")
 
+def remark_masks(remarks, needles):
+    """{needle: boolean mask of the rows whose remark contains it, ignoring
+    case}. A Remarks column only holds a handful of distinct labels, so each
+    label is tested once and the answer is mapped back by code."""
+    codes, uniques = pd.factorize(remarks)
+    labels = [u.lower() if isinstance(u, str) else None for u in uniques]
+    masks = {}
+    for needle in needles:
+        hits = np.array([lbl is not None and needle.lower() in lbl for lbl in labels] + [False])
+        masks[needle] = hits[codes]
+    return masks
+
 def generate_discrepancy_sheets(writer, portal_dict, books_dict, include_mismatches=True):
     not_in_books = []
     prev_period = []
     mismatches = []
 
+    def collect(out, df, mask, sheet_name):
+        if not mask.any(): return
+        sub = df[mask]  # boolean indexing already returns a fresh frame
+        sub.insert(0, 'Source Sheet', sheet_name)
+        out.append(sub)
+
     for sheet_name, df in portal_dict.items():
         if 'Remarks' not in df.columns: continue
 
-        nib_df = df[df['Remarks'].str.contains("Not in Books", case=False, na=False)].copy()
-        if not nib_df.empty:
-            nib_df.insert(0, 'Source Sheet', sheet_name)
-            not_in_books.append(nib_df)
-
-        prev_df = df[df['Remarks'].str.contains("Previous", case=False, na=False)].copy()
-        if not prev_df.empty:
-            prev_df.insert(0, 'Source Sheet', sheet_name)
-            prev_period.append(prev_df)
-
-        # "Mismatch" is a substring of "Mismatch (Rate Diff)" too, so this
-        # picks up both flavors -- genuinely the same invoice on both sides,
-        # different amount or different tax split.
-        mis_df = df[df['Remarks'].str.contains("Mismatch", case=False, na=False)].copy()
-        if not mis_df.empty:
-            mis_df.insert(0, 'Source Sheet', sheet_name)
-            mismatches.append(mis_df)
+        # "Mismatch" is a substring of "Mismatch (Rate Diff)" too, so that
+        # mask picks up both flavors -- genuinely the same invoice on both
+        # sides, different amount or different tax split.
+        masks = remark_masks(df['Remarks'], ["Not in Books", "Previous", "Mismatch"])
+        collect(not_in_books, df, masks["Not in Books"], sheet_name)
+        collect(prev_period, df, masks["Previous"], sheet_name)
+        collect(mismatches, df, masks["Mismatch"], sheet_name)
 
     not_on_portal = []
     for sheet_name, data in books_dict.items():
         df = data['df']
         if 'Remarks' not in df.columns: continue
-
-        nop_df = df[df['Remarks'].str.contains("Not on Portal", case=False, na=False)].copy()
-        if not nop_df.empty:
-            nop_df.insert(0, 'Source Sheet', sheet_name)
-            not_on_portal.append(nop_df)
+        collect(not_on_portal, df, remark_masks(df['Remarks'], ["Not on Portal"])["Not on Portal"], sheet_name)
 
     # Mismatches is the highest-priority sheet for a reviewer (a real
     # discrepancy that needs correcting, not just something missing), so
@@ -897,12 +1108,13 @@ def get_smart_sorted_order(portal_dict, books_dict):
     final = []; used = set()
     bk = list(books_dict.keys())
     def clean(n): return n.lower().replace(" ", "").replace("-", "").replace("_", "").replace("(portal)", "").replace("(books)", "")
+    bk_clean = {b: clean(b) for b in bk}  # once, not once per portal sheet
     
     for p_name, p_df in portal_dict.items():
         best = None; p_cl = clean(p_name)
         for b in bk:
             if b in used: continue
-            b_cl = clean(b)
+            b_cl = bk_clean[b]
             if p_cl == b_cl or (p_cl=='b2b' and b_cl=='b2b') or (p_cl in b_cl) or (b_cl in p_cl):
                 best = b; break
         final.append((f"{p_name[:20]} (Portal)", p_df))
@@ -911,7 +1123,9 @@ def get_smart_sorted_order(portal_dict, books_dict):
     
     for b, data in books_dict.items():
         if b not in used: final.append((f"{b[:20]} (Books)", data['df']))
-    return final
+    # Names sharing their first 20 chars would repeat a title
+    titles = unique_sheet_names(title for title, _ in final)
+    return [(title, df) for title, (_, df) in zip(titles, final)]
 
 # ==========================================
 #  MAIN ENTRY POINT (CALLED BY APP.PY)
@@ -933,7 +1147,11 @@ def generate_reco_report_zoho(file_portal, file_zoho, manual_inputs=None, month_
     output = BytesIO()
     processed_portal_dfs, zoho_data, reference_sheets = compute_reco_data_zoho(file_portal, file_zoho, month_str)
 
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+    # constant_memory streams each finished row to disk instead of holding
+    # every sheet's cells in memory until save -- see add_formatting for the
+    # row-order constraint it imposes.
+    with pd.ExcelWriter(output, engine='xlsxwriter',
+                        engine_kwargs={'options': {'constant_memory': True, 'strings_to_numbers': False}}) as writer:
         # 5. Generate Summaries
         closing_balance = generate_master_dashboard(writer, processed_portal_dfs, zoho_data, manual_inputs)
         generate_vendor_summary(writer, processed_portal_dfs, zoho_data)
@@ -1015,16 +1233,14 @@ def _sum4_zoho(df):
     0 for the tax columns (only 'Taxable Value' happened to still match,
     since that rename key has no such space mismatch). Uses the same
     substring-based column lookup already used elsewhere in this file
-    (see generate_lookup_maps' find_fin_col) instead of relying on the
-    rename."""
+    (see find_col) instead of relying on the rename."""
     if df is None or df.empty:
         return {'taxable': 0.0, 'igst': 0.0, 'cgst': 0.0, 'sgst': 0.0}
-    def find_col(keywords):
-        return next((c for c in df.columns if any(k in str(c).lower() for k in keywords)), None)
-    tax_col = find_col(['taxable'])
-    igst_col = find_col(['igst', 'integrated'])
-    cgst_col = find_col(['cgst', 'central'])
-    sgst_col = find_col(['sgst', 'state', 'ut'])
+    lc = lower_cols(df)
+    tax_col = find_col(lc, ['taxable'])
+    igst_col = find_col(lc, ['igst', 'integrated'])
+    cgst_col = find_col(lc, ['cgst', 'central'])
+    sgst_col = find_col(lc, ['sgst', 'state', 'ut'])
     def s(col):
         return float(pd.to_numeric(df[col], errors='coerce').fillna(0).sum()) if col else 0.0
     return {'taxable': s(tax_col), 'igst': s(igst_col), 'cgst': s(cgst_col), 'sgst': s(sgst_col)}
@@ -1,35 +1,63 @@
 import pandas as pd
+import numpy as np
 import os
-import re
 import xlsxwriter
 from xlsxwriter.utility import xl_col_to_name
 
+from modules.indirect_tax.gstr_reco_common import sheet_formats, unique_sheet_names, write_data_rows
+
 # --- CONFIGURATION ---
-SHEETS_TO_DELETE_ALWAYS = [
+SHEETS_TO_DELETE_ALWAYS = {
     'imp', 'imp_services', 'nil,exempt,non-gst,composition', 
     'hsn', 'advance paid', 'advance adjusted'
-]
-SHEETS_TO_CHECK = [
+}
+SHEETS_TO_CHECK = {
     'b2b', 'b2bur', 'dn', 'dn_ur', 'reverse charge'
-]
+}
+
+# Characters not allowed in output file names, each mapped to '-'
+FILENAME_BAD_CHARS = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))
+
+# Summary key -> source column totalled for each written sheet
+SUMMARY_COLS = {
+    'Taxable': 'Taxable Value', 'IGST': 'IGST Tax Amount',
+    'CGST': 'CGST Tax Amount', 'SGST': 'SGST Tax Amount'
+}
+
+def output_sheet_names(original_names):
+    """'<name> as per Books' for each sheet, made unique within Excel's
+    31-char limit (see gstr_reco_common.unique_sheet_names)."""
+    return unique_sheet_names(f"{original} as per Books" for original in original_names)
 
-def write_sheet_with_subtotals(writer, df, sheet_name):
+def remove_quietly(path):
+    """os.remove that ignores a file already gone (no exists() pre-check to race)."""
+    try: os.remove(path)
+    except OSError: pass
+
+def write_sheet_with_subtotals(writer, df, sheet_name, formats):
     """
     Writes DF to Excel using XlsxWriter and adds:
     1. Bold Filters
     2. Subtotals (Formula = 9) at the bottom
+    formats comes from gstr_reco_common.sheet_formats, built once per workbook.
     """
-    df.to_excel(writer, sheet_name=sheet_name, index=False)
-    
-    workbook = writer.book
-    worksheet = writer.sheets[sheet_name]
+    worksheet = writer.book.add_worksheet(sheet_name)
     (num_rows, num_cols) = df.shape
 
-    bold_format = workbook.add_format({'bold': True})
-    number_format = workbook.add_format({'bold': True, 'num_format': '#,##0.00'})
-    
+    # The workbook is written in constant_memory mode, where a row is flushed
+    # as soon as a later one is started, so cells go out strictly top to
+    # bottom and sheet-level settings come first. (df.to_excel writes column
+    # by column and would lose every earlier row in that mode.)
+    worksheet.autofilter(0, 0, num_rows, num_cols - 1)
+    for col_idx, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            worksheet.set_column(col_idx, col_idx, None, formats['date'])
+
+    worksheet.write_row(0, 0, df.columns.tolist(), formats['plain_header'])
+    write_data_rows(worksheet, df, formats)
+
     # Write "Filter Total" label
-    worksheet.write(num_rows + 1, 0, 'Filter Total', bold_format)
+    worksheet.write(num_rows + 1, 0, 'Filter Total', formats['bold'])
     
     # Add Subtotal Formulas dynamically
     target_cols = ['Taxable Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount', 'Cess Amount']
@@ -40,10 +68,7 @@ def write_sheet_with_subtotals(writer, df, sheet_name):
             col_letter = xl_col_to_name(col_idx)
             # Formula: =SUBTOTAL(9, C2:C100)
             formula = f'=SUBTOTAL(9,{col_letter}2:{col_letter}{num_rows+1})'
-            worksheet.write_formula(num_rows + 1, col_idx, formula, number_format)
-
-    # Add AutoFilter
-    worksheet.autofilter(0, 0, num_rows, num_cols - 1)
+            worksheet.write_formula(num_rows + 1, col_idx, formula, formats['number'])
 
 def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
     """
@@ -54,7 +79,7 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
         
         # Naming Logic
         if custom_filename and str(custom_filename).strip():
-            clean_name = re.sub(r'[\\/*?:"<>|]', '-', str(custom_filename).strip())
+            clean_name = str(custom_filename).strip().translate(FILENAME_BAD_CHARS)
             output_filename = f"{clean_name}.xlsx" if not clean_name.endswith('.xlsx') else clean_name
         else:
             output_filename = "Zoho_2B_Cleaned.xlsx"
@@ -77,7 +102,9 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
                 
             elif sheet_name_lower in SHEETS_TO_CHECK:
                 try:
-                    df_check = pd.read_excel(xls, sheet_name=sheet_name, header=None)
+                    # Only the first 3 rows are needed to see whether the
+                    # sheet has any data; the full sheet is parsed once below.
+                    df_check = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=3)
                     if len(df_check) < 3 or df_check.iloc[2].isnull().all():
                         continue
                     else:
@@ -112,12 +139,10 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
             rcm_df = sheet_map['reverse charge']['df']
             
             if 'Invoice Number' in b2b_df.columns and 'Invoice Number' in rcm_df.columns:
-                # Get list of Invoice Numbers present in RCM sheet
-                rcm_invoices = rcm_df['Invoice Number'].unique()
-                
-                # Keep only rows in B2B that are NOT in the RCM list
+                # Keep only rows in B2B that are NOT in the RCM sheet
                 # "Consider it in RCM sheet only and delete from B2B"
-                clean_b2b_df = b2b_df[~b2b_df['Invoice Number'].isin(rcm_invoices)].copy()
+                # (isin hashes the RCM column itself, so no separate unique() pass)
+                clean_b2b_df = b2b_df[~b2b_df['Invoice Number'].isin(rcm_df['Invoice Number'])].copy()
                 
                 # Update the map
                 sheet_map['b2b']['df'] = clean_b2b_df
@@ -128,7 +153,14 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
         sheets_kept = 0
         summary_data = [] 
 
-        with pd.ExcelWriter(output_full_path, engine='xlsxwriter') as writer:
+        with pd.ExcelWriter(output_full_path, engine='xlsxwriter',
+                            engine_kwargs={'options': {'constant_memory': True}}) as writer:
+            formats = sheet_formats(writer.book)
+
+            # Output names for the sheets that get written, resolved up front
+            # so two long names cut to the same 31 chars can't collide
+            kept = [key for key, data in sheet_map.items() if not data['df'].empty]
+            sheet_names = dict(zip(kept, output_sheet_names(sheet_map[key]['original_name'] for key in kept)))
             
             for key, data in sheet_map.items():
                 df_to_keep = data['df']
@@ -138,18 +170,21 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
                     continue
 
                 # Rename Sheet
-                new_sheet_name = f"{original_name} as per Books"
-                if len(new_sheet_name) > 31:
-                    new_sheet_name = new_sheet_name[:31]
-
-                # Add Columns
-                df_to_keep['As per portal'] = ''
-                df_to_keep['Difference'] = ''
-                df_to_keep['Remarks'] = ''
+                new_sheet_name = sheet_names[key]
+
+                # Add Columns -- one assign (no in-place writes into the
+                # footer-trimmed slice); a one-category blank column holds an
+                # int8 code per row instead of a string pointer
+                blank = pd.Categorical.from_codes(np.zeros(len(df_to_keep), dtype=np.int8), categories=[''])
+                df_to_keep = df_to_keep.assign(**{'As per portal': blank, 'Difference': blank, 'Remarks': blank})
                 
                 # Drop Empty Cess
                 if 'Cess Amount' in df_to_keep.columns:
-                    if (pd.to_numeric(df_to_keep['Cess Amount'], errors='coerce').fillna(0) <= 0).all():
+                    cess = df_to_keep['Cess Amount']
+                    # Numeric columns are tested as-is (NaN > 0 is False);
+                    # only text/mixed ones need coercing first
+                    if cess.dtype.kind not in 'biuf': cess = pd.to_numeric(cess, errors='coerce')
+                    if not (cess.to_numpy() > 0).any():
                         df_to_keep = df_to_keep.drop(columns=['Cess Amount'])
 
                 # Reorder Columns
@@ -167,31 +202,28 @@ def process_gstr2b_zoho(file_path, output_folder, custom_filename=None):
 
                 # Select existing cols
                 existing_cols = [c for c in final_order if c in df_to_keep.columns]
-                df_to_keep = df_to_keep.reindex(columns=existing_cols)
+                df_to_keep = df_to_keep.loc[:, existing_cols]
                 
                 # Write Sheet
-                write_sheet_with_subtotals(writer, df_to_keep, new_sheet_name)
+                write_sheet_with_subtotals(writer, df_to_keep, new_sheet_name, formats)
                 sheets_kept += 1
 
-                # Add to Summary
-                for col in ['Taxable Value', 'IGST Tax Amount', 'CGST Tax Amount', 'SGST Tax Amount']:
-                    if col in df_to_keep.columns:
-                        df_to_keep[col] = pd.to_numeric(df_to_keep[col], errors='coerce').fillna(0)
-                
-                summary_data.append({
-                    'Category': original_name,
-                    'Taxable': df_to_keep['Taxable Value'].sum() if 'Taxable Value' in df_to_keep.columns else 0,
-                    'IGST': df_to_keep['IGST Tax Amount'].sum() if 'IGST Tax Amount' in df_to_keep.columns else 0,
-                    'CGST': df_to_keep['CGST Tax Amount'].sum() if 'CGST Tax Amount' in df_to_keep.columns else 0,
-                    'SGST': df_to_keep['SGST Tax Amount'].sum() if 'SGST Tax Amount' in df_to_keep.columns else 0,
-                })
+                # Add to Summary -- coerce the present tax columns once into a
+                # float block and sum it column-wise (plain floats, so the
+                # result stays JSON-serialisable)
+                summary = {'Category': original_name, 'Taxable': 0, 'IGST': 0, 'CGST': 0, 'SGST': 0}
+                present = [(key, col) for key, col in SUMMARY_COLS.items() if col in df_to_keep.columns]
+                if present:
+                    block = df_to_keep[[col for _, col in present]].apply(pd.to_numeric, errors='coerce')
+                    totals = block.to_numpy(dtype='float64', na_value=0.0).sum(axis=0)
+                    for (key, _), total in zip(present, totals): summary[key] = float(total)
+                summary_data.append(summary)
 
         if sheets_kept == 0:
             return {"success": False, "error": "No valid sheets found (or files were empty)."}
 
         # Clean up input file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        remove_quietly(file_path)
 
         return {
             "success": True,
@@ -26,6 +26,7 @@ entry -- confirmed with the firm that this specific step stays manual.
 from io import BytesIO
 
 import pandas as pd
+import numpy as np
 
 from modules.indirect_tax.gstr1_odoo import compute_gstr1_data
 from modules.indirect_tax.gstr2b_reco_engine import (
@@ -69,6 +70,15 @@ def _is_previous_month_input(remark):
 def _is_itc_available(value):
     return str(value or '').strip().lower() == 'yes'
 
+def _value_mask(s, predicate):
+    """predicate(value) for every cell of s, evaluated once per distinct
+    value -- Remarks / ITC Availability only hold a handful -- and mapped
+    back by code. Blanks (NaN/None) are one value here; every predicate
+    above treats them alike."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    hits = np.array([bool(predicate(u)) for u in uniques], dtype=bool)
+    return pd.Series(hits[codes], index=s.index)
+
 def _real_rows(df):
     """Excludes a sheet's own pre-existing 'Filter Total' row (identified by
     a blank Invoice Number) -- present in some already-processed exports and
@@ -121,7 +131,7 @@ def compute_gstr2b_buckets(processed_portal, processed_books):
     def filter_rows(df, remark_predicate):
         if df is None or df.empty or 'Remarks' not in df.columns or 'ITC Availability' not in df.columns:
             return pd.DataFrame()
-        mask = df['Remarks'].apply(remark_predicate) & df['ITC Availability'].apply(_is_itc_available)
+        mask = _value_mask(df['Remarks'], remark_predicate) & _value_mask(df['ITC Availability'], _is_itc_available)
         return df[mask]
 
     bucket_a_rows = filter_rows(b2b_portal, _is_claimable_remark)
@@ -0,0 +1,118 @@
+"""
+Shared helpers for the GSTR-2B engines -- the Odoo and Zoho reconciliation
+engines and the Zoho 2B cleaner all clean portal data and stream sheets out
+through xlsxwriter the same way, so these live here once instead of being
+copied into each module.
+"""
+import weakref
+from datetime import date, datetime
+
+import pandas as pd
+
+
+def is_yes_flag(s):
+    """Boolean mask of a Yes/No column ('Y', ' yes ', ...). Flag columns
+    hold a handful of distinct values, so only those are normalised and the
+    answer is mapped back by code -- no per-row string copies."""
+    codes, uniques = pd.factorize(s)
+    if not len(uniques): return pd.Series(False, index=s.index)
+    yes = pd.Index(uniques).astype(str).str.strip().str.lower().isin(['yes', 'y'])
+    return pd.Series(yes[codes] & (codes >= 0), index=s.index)
+
+
+def dedup_columns(df):
+    """df without repeated column labels (first one kept). Returned as-is,
+    not copied, when every label is already unique -- the usual case."""
+    dup = df.columns.duplicated()
+    return df.loc[:, ~dup] if dup.any() else df
+
+
+def coerce_numeric_cols(df, cols):
+    """Converts the columns of `cols` present in df to numbers in place
+    (unparseable -> 0) and returns the ones present. Coerced as one block;
+    columns are then swapped in whole (a list-keyed assignment would write
+    into the existing object columns in place)."""
+    present = [c for c in cols if c in df.columns]
+    converted = df[present].apply(pd.to_numeric, errors='coerce').fillna(0)
+    for col in present: df[col] = converted[col]
+    return present
+
+
+# ==========================================
+#  XLSXWRITER OUTPUT
+# ==========================================
+
+def unique_sheet_names(titles):
+    """titles cut to Excel's 31-char limit, with a ' (2)', ' (3)'... suffix
+    where a title would repeat one already taken -- add_worksheet raises
+    DuplicateWorksheetName on a repeat (compared case-insensitively, as
+    Excel does)."""
+    names, taken = [], set()
+    for title in titles:
+        base = str(title)[:31]
+        name, n = base, 1
+        while name.lower() in taken:
+            n += 1
+            suffix = f" ({n})"
+            name = base[:31 - len(suffix)] + suffix
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+# A report writes a dozen or more sheets into the same workbook, and
+# add_format registers a new (identical) entry in the styles table on every
+# call otherwise -- so formats are built once per workbook on first use.
+_FORMAT_CACHE = weakref.WeakKeyDictionary()
+
+def sheet_formats(workbook):
+    fmts = _FORMAT_CACHE.get(workbook)
+    if fmts is None:
+        fmts = {
+            'header': workbook.add_format({'bold': True, 'bg_color': '#D7E4BC', 'border': 1}),
+            # Same look as the header pandas' to_excel writes
+            'plain_header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+            'bold': workbook.add_format({'bold': True}),
+            'number': workbook.add_format({'bold': True, 'num_format': '#,##0.00'}),
+            'red': workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006'}),
+            'green': workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'}),
+            'date': workbook.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'}),
+            'day': workbook.add_format({'num_format': 'YYYY-MM-DD'}),
+        }
+        _FORMAT_CACHE[workbook] = fmts
+    return fmts
+
+
+def excel_rows(df):
+    """Row-major plain-Python rows for worksheet.write_row. NaN/NaT become
+    None (a blank cell) -- xlsxwriter rejects NaN outright, which is what
+    df.to_excel's na_rep='' used to paper over."""
+    return df.astype(object).where(df.notna(), None).to_numpy().tolist()
+
+
+def stray_date_cells(df):
+    """{sheet row: [column, ...]} of date/datetime values held in object
+    columns (books exports, mixed-type columns). Only datetime64 columns get
+    the column-wide date format, so these are re-written cell by cell with
+    one -- df.to_excel used to format each of them. NaT is a datetime too,
+    but goes out as a blank cell."""
+    cells = {}
+    for col_num in range(df.shape[1]):
+        col = df.iloc[:, col_num]
+        if col.dtype != object: continue
+        kind = pd.api.types.infer_dtype(col, skipna=True)
+        if kind not in ('datetime', 'date') and not kind.startswith('mixed'): continue
+        is_date = (col.map(lambda v: isinstance(v, date)) & col.notna()).to_numpy(dtype=bool)
+        for r in is_date.nonzero()[0]: cells.setdefault(r + 1, []).append(col_num)
+    return cells
+
+
+def write_data_rows(worksheet, df, fmts):
+    """Writes df's values below a header row (sheet rows 1..len(df)),
+    strictly top to bottom so it is safe under constant_memory. Dates in
+    object columns keep a date format (see stray_date_cells)."""
+    stray_dates = stray_date_cells(df)
+    for row_num, row in enumerate(excel_rows(df), start=1):
+        worksheet.write_row(row_num, 0, row)
+        for col_num in stray_dates.get(row_num, ()):
+            value = row[col_num]
+            worksheet.write_datetime(row_num, col_num, value, fmts['date'] if isinstance(value, datetime) else fmts['day'])
@@ -174,6 +174,32 @@ def test_native_itc_availability_not_wiped():
     print("Native ITC Availability preserved (not wiped when no reference data): OK")
 
 
+def test_detail_sheet_titles_stay_unique():
+    """A paired books sheet takes its portal sheet's title, so a leftover
+    books sheet of the same name -- or two portal names sharing their first
+    20 chars -- must not repeat a title (add_worksheet would raise
+    DuplicateWorksheetName and fail the whole report)."""
+    from modules.indirect_tax.gstr2b_reco_engine import get_smart_sorted_order, add_formatting_and_subtotals
+
+    def sheet(*invs):
+        return pd.DataFrame({'Invoice Number': list(invs), 'Taxable Value': [100.0] * len(invs)})
+
+    portal = {'B2B': sheet('INV-1'), 'Credit Debit Notes Amendment A': sheet('CN-1'),
+              'Credit Debit Notes Amendment B': sheet('CN-2')}
+    books = {'B2B-Odoo': sheet('INV-1'), 'B2B': sheet('INV-9')}
+
+    sheets = get_smart_sorted_order(portal, books)
+    titles = [title for title, _ in sheets]
+    assert len({t.lower() for t in titles}) == len(titles) == 5, titles
+    assert all(len(t) <= 31 for t in titles), titles
+
+    with pd.ExcelWriter(BytesIO(), engine='xlsxwriter') as writer:
+        for title, df in sheets: add_formatting_and_subtotals(writer, df, title)
+
+    print("Detail sheet titles stay unique: OK")
+
+
 if __name__ == '__main__':
     test_gstr2b_reco_engine()
     test_native_itc_availability_not_wiped()
+    test_detail_sheet_titles_stay_unique()
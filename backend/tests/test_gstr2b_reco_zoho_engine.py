@@ -288,9 +288,91 @@ def test_master_dashboard_formulas_reference_correct_rows():
 
     print("Master Dashboard formulas reference the correct rows: OK")
 
+def test_exact_match_ignores_float_noise_in_amounts():
+    """Amounts that only differ by float noise (0.1 + 0.2 vs 0.3) are the
+    same paisa figure and must take the exact "Match" pass, not fall through
+    to the amount-agnostic "Mismatch" pass."""
+    from modules.indirect_tax.gstr2b_reco_zoho_engine import generate_lookup_maps, reconcile_dataframe
+
+    gstin = '27AAAAA0000A1Z5'
+    books = pd.DataFrame({'GSTIN of supplier': [gstin], 'Invoice Number': ['INV-9'], 'Taxable Value': [0.1 + 0.2]})
+    portal = pd.DataFrame({'GSTIN of supplier': [gstin], 'Invoice Number': ['INV/9'], 'Taxable Value': [0.3]})
+
+    result = reconcile_dataframe(portal, generate_lookup_maps({'b2b': {'df': books}}), 'As per Books', True)
+    assert result['Remarks'].tolist() == ['Match']
+
+    print("Exact match ignores float noise: OK")
+
+def test_smart_offset_carries_forward_whole_paise():
+    """The Section 49 set-off chain runs in paise, so the credit carried
+    forward is the exact paise figure, not a float-drifted one."""
+    from modules.indirect_tax.gstr2b_reco_zoho_engine import calculate_smart_offset
+
+    paid, cash, balance = calculate_smart_offset({'i': 0.3, 'c': 0.0, 's': 0.0}, {'i': 0.1 + 0.2 + 0.1, 'c': 0.0, 's': 0.0})
+    assert paid['i_i'] == 0.3
+    assert cash['i'] == 0.0
+    assert balance['i'] == 0.1
+
+    print("Smart offset carries forward whole paise: OK")
+
+def test_smart_offset_treats_non_finite_amounts_as_zero():
+    """float() accepts "nan"/"inf" from the dashboard form; the paise
+    conversion must not raise on them."""
+    from modules.indirect_tax.gstr2b_reco_zoho_engine import calculate_smart_offset
+
+    paid, cash, balance = calculate_smart_offset({'i': float('nan'), 'c': 5.0, 's': 0.0}, {'i': float('inf'), 'c': 2.0, 's': 0.0})
+    assert paid['c_c'] == 2.0
+    assert cash == {'i': 0.0, 'c': 3.0, 's': 0.0}
+    assert balance['i'] == 0.0
+
+    print("Smart offset treats non-finite amounts as zero: OK")
+
+def test_master_dashboard_treats_non_finite_manual_inputs_as_zero():
+    """A "nan"/"inf" manual input is cleaned to 0 before it reaches the
+    set-off or the dashboard cells (write_number would reject it)."""
+    import openpyxl
+
+    manual_inputs = {
+        'sales': {'igst': float('nan'), 'cgst': 1000.0, 'sgst': 1000.0},
+        'opening': {'igst': float('inf'), 'cgst': 0.0, 'sgst': 0.0},
+    }
+
+    output = generate_reco_report_zoho(_build_portal_file(), _build_zoho_file(), manual_inputs, '2025-12')
+    ws = openpyxl.load_workbook(output)['Master Dashboard']
+    cells = {str(ws.cell(row=r, column=1).value or '').strip(): ws.cell(row=r, column=3).value for r in range(1, ws.max_row + 1)}
+    assert cells['1. Output Liability'] == 0, cells
+    assert cells['4. Opening Balance'] == 0, cells
+
+    print("Master Dashboard treats non-finite manual inputs as zero: OK")
+
+def test_detail_sheet_titles_stay_unique():
+    """Detail sheet titles keep only the first 20 chars of the source name;
+    two names sharing those must still get distinct worksheets rather than
+    add_worksheet raising DuplicateWorksheetName."""
+    from modules.indirect_tax.gstr2b_reco_zoho_engine import get_smart_sorted_order, add_formatting
+
+    df = pd.DataFrame({'Invoice Number': ['INV-1'], 'Taxable Value': [100.0]})
+    portal = {'Credit Debit Notes Amendment A': df, 'Credit Debit Notes Amendment B': df}
+    books = {'Purchase Register Q1 North': {'df': df}, 'Purchase Register Q1 South': {'df': df}}
+
+    sheets = get_smart_sorted_order(portal, books)
+    titles = [title for title, _ in sheets]
+    assert len({t.lower() for t in titles}) == len(titles) == 4, titles
+    assert all(len(t) <= 31 for t in titles), titles
+
+    with pd.ExcelWriter(BytesIO(), engine='xlsxwriter') as writer:
+        for title, sheet_df in sheets: add_formatting(writer, sheet_df, title)
+
+    print("Detail sheet titles stay unique: OK")
+
 
 if __name__ == '__main__':
     test_gstr2b_reco_zoho_engine()
     test_master_dashboard_formulas_reference_correct_rows()
     test_itc_availability_survives_real_shaped_portal_file()
     test_gstr2b_buckets_sum_real_shaped_tax_columns_correctly()
+    test_exact_match_ignores_float_noise_in_amounts()
+    test_smart_offset_carries_forward_whole_paise()
+    test_smart_offset_treats_non_finite_amounts_as_zero()
+    test_master_dashboard_treats_non_finite_manual_inputs_as_zero()
+    test_detail_sheet_titles_stay_unique()